@@ -1,12 +1,16 @@
-import io
 import os
 import sys
+import shutil
 import zipfile
 import requests
+import threading
 import subprocess
 
 from tqdm import tqdm
-from config import LAST_AVAILABLE_DATASET
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, wait, FIRST_COMPLETED
+from config import LAST_AVAILABLE_DATASET, MAX_PARALLEL_DOWNLOADS, ARCHIVE_WINDOW_MONTHS, path_to_archives
+from functions.api_func import stream_download
+from functions.store_func import read_manifest, write_manifest, month_index
 
 def ask_user_input():
     # Detect the platform and open a new terminal to ask for input
@@ -23,61 +27,197 @@ def ask_user_input():
     return input("Do you want to run the dataloader? (Y/Yes to proceed): ")
 
 
-# Ask the user for input
-print("For loading the dataset, you need to have 5-6 Gb of memory available for this datasets\n")
-user_input = ask_user_input()
-
-# Check if the input is 'Y' or 'Yes'
-if user_input.lower() in ['y', 'yes']:
-
-    print("Good, here we go... \n")
-
-    urls = [
-        'https://data.police.uk/data/archive/2016-12.zip',
-        'https://data.police.uk/data/archive/2019-12.zip',
-        'https://data.police.uk/data/archive/2022-12.zip',
-        'https://data.police.uk/data/archive/2024-03.zip'
-    ]
- 
-    if LAST_AVAILABLE_DATASET is not None:
-        urls.append(LAST_AVAILABLE_DATASET)
-
-    # Define the target directory for extraction
-    target_dir = 'data/met_data'
-
-    # Ensure the target directory exists
-    os.makedirs(target_dir, exist_ok=True)
-
-    custom_format = "{desc}: {percentage:.0f}%\x1b[33m|\x1b[0m\x1b[32m{bar}\x1b[0m\x1b[31m{remaining}\x1b[0m\x1b[33m|\x1b[0m {n}/{total} [{elapsed}<{remaining}]"
-
-    epoch = 1
+def archive_label(url: str) -> str:
+    """The "YYYY-MM" month of an archive url, archives with a later label are more recent."""
+    return url.split('/')[-1].split('.')[0]
+
+
+def plan_extraction(archive_path: str, label: str, manifest: dict, target_dir: str, newer_labels: list):
+    """
+    Decides which metropolitan months of an archive have to be extracted, using only the central directory of the zip.
+
+    A month is skipped when the manifest already holds it from a more recent archive, and deferred when a more recent
+    archive of this run is expected to contain it (archives hold a rolling window of ARCHIVE_WINDOW_MONTHS months).
+    Files whose CRC and size match the manifest are not extracted again.
+
+    Returns
+    -
+    Three dictionaries keyed by month: the files of the months to (re)attribute to this archive,
+    the files among them that have to be written to disk, and the files of the deferred months.
+    """
+    months = {}
+    with zipfile.ZipFile(archive_path, 'r') as zip_ref:
+        for info in zip_ref.infolist():
+            if 'metropolitan' in info.filename and not info.is_dir():
+                month = info.filename.split('/')[0]
+                months.setdefault(month, {})[info.filename] = {'crc': info.CRC, 'size': info.file_size}
+
+    attribute, changed, deferred = {}, {}, {}
+    for month, files in months.items():
+        current = manifest['months'].get(month)
+        if current is not None and current['archive'] > label:
+            continue
+        if any(month_index(newer) - ARCHIVE_WINDOW_MONTHS < month_index(month) <= month_index(newer) for newer in newer_labels):
+            deferred[month] = files
+            continue
+
+        attribute[month] = files
+        changed_files = [file for file, meta in files.items()
+                         if current is None or current['files'].get(file) != meta or not os.path.exists(os.path.join(target_dir, file))]
+        if changed_files:
+            changed[month] = changed_files
+
+    return attribute, changed, deferred
+
+
+def extract_metropolitan_files(archive_path: str, target_dir: str, members: list) -> int:
+    """
+    Extracts the given members of a downloaded archive into `target_dir`.
+    Runs in a worker process, every member is written to a temporary file first and then moved in place,
+    such that a half written file is never left behind.
+    """
+    with zipfile.ZipFile(archive_path, 'r') as zip_ref:
+        for file in members:
+            target_path = os.path.join(target_dir, file)
+            os.makedirs(os.path.dirname(target_path), exist_ok=True)
+            tmp_path = f"{target_path}.{os.getpid()}.tmp"
+            with zip_ref.open(file) as src, open(tmp_path, 'wb') as dst:
+                shutil.copyfileobj(src, dst)
+            os.replace(tmp_path, target_path)
+
+    return len(members)
+
+
+def run_pipeline(urls: list, target_dir: str, max_downloads: int = MAX_PARALLEL_DOWNLOADS):
+    """
+    Downloads the archives concurrently (at most `max_downloads` at the same time) and hands every finished
+    archive to a process pool for extraction, so downloading and extracting overlap.
+    A single progress bar shows the bytes downloaded over all archives.
+
+    Only months that are missing on disk, or changed in a more recent archive, are extracted;
+    the manifest in `target_dir` records where every materialised month comes from.
+    """
+    # the sizes of the archives, such that the progress bar can show the total
+    total = 0
     for url in urls:
-        # Download the file
-        response = requests.get(url)
-        if response.status_code == 200:
-            # Create a BytesIO object from the response content
-            zip_file = io.BytesIO(response.content)
-
-            # Open the zip file
-            with zipfile.ZipFile(zip_file, 'r') as zip_ref:
-                # List all files in the zip archive
-                all_files = zip_ref.namelist()
-
-                # Filter files of interest
-                target_files = [f for f in all_files if 'metropolitan' in f]
-
-                # Extract only the target files to the target directory
-                for file in tqdm(target_files, desc=f"Downloading files epoch {epoch}/{len(urls)}", dynamic_ncols=True, bar_format=custom_format, ascii=' -'):
-                    zip_ref.extract(file, target_dir)
-                
-                print(f'Files extracted and saved to {target_dir}\n')
-            epoch += 1
-        else:
-            print(f"Failed to download file. Status code: {response.status_code}, {response.url} may not be valid, make sure that link in form of {urls[0]}\n")
-
-    # Verify extraction by listing the extracted files (Optional)
-    extracted_files = os.listdir(target_dir)
-    print("Extracted files:", extracted_files, '\n')
-
-else:
-    print("Dataloader was not run. Exiting shuting down.")
+        try:
+            total += int(requests.head(url, allow_redirects=True, timeout=10).headers.get('Content-Length', 0))
+        except requests.RequestException:
+            pass
+
+    custom_format = "{desc}: {percentage:.0f}%\x1b[33m|\x1b[0m\x1b[32m{bar}\x1b[0m\x1b[31m{remaining}\x1b[0m\x1b[33m|\x1b[0m {n_fmt}/{total_fmt} [{elapsed}<{remaining}]{postfix}"
+    lock = threading.Lock()
+    downloaded, extracted = 0, 0
+
+    manifest = read_manifest(target_dir)
+    labels = {url: archive_label(url) for url in urls}
+    failed = set()
+    archives, deferred = {}, {}
+
+    with tqdm(total=total or None, desc=f"Archives 0/{len(urls)}", unit='B', unit_scale=True, dynamic_ncols=True, bar_format=custom_format, ascii=' -') as bar, \
+            ThreadPoolExecutor(max_workers=max_downloads) as download_pool, \
+            ProcessPoolExecutor(max_workers=min(len(urls), os.cpu_count() or 1)) as extract_pool:
+
+        def update(n_bytes):
+            with lock:
+                bar.update(n_bytes)
+
+        def submit(label: str, attribute: dict, changed: dict):
+            # months without changed files only need to be attributed to this archive
+            for month in set(attribute) - set(changed):
+                manifest['months'][month] = {'archive': label, 'files': attribute[month]}
+            write_manifest(target_dir, manifest)
+
+            members = [file for files in changed.values() for file in files]
+            future = extract_pool.submit(extract_metropolitan_files, archives[label], target_dir, members)
+            extractions[future] = (label, {month: attribute[month] for month in changed})
+            return future
+
+        def finish(future):
+            label, months = extractions.pop(future)
+            n_files = future.result()
+            for month, files in months.items():
+                manifest['months'][month] = {'archive': label, 'files': files}
+            write_manifest(target_dir, manifest)
+            bar.write(f'{n_files} files from archive {label} extracted and saved to {target_dir}')
+
+        downloads = {download_pool.submit(stream_download, url, path_to_archives, callback=update): url for url in urls}
+        extractions = {}
+
+        while downloads or extractions:
+            done, _ = wait(set(downloads) | set(extractions), return_when=FIRST_COMPLETED)
+            for future in done:
+                if future in downloads:
+                    url = downloads.pop(future)
+                    try:
+                        archive_path = future.result()
+                    except (requests.HTTPError, IOError, ValueError) as e:
+                        bar.write(f"Failed to download file. {e}, {url} may not be valid, make sure that link in form of {urls[0]}\n")
+                        failed.add(labels[url])
+                        continue
+                    downloaded += 1
+                    label = labels[url]
+                    archives[label] = archive_path
+                    newer_labels = [other for other in labels.values() if other > label and other not in failed]
+                    attribute, changed, deferred[label] = plan_extraction(archive_path, label, manifest, target_dir, newer_labels)
+                    submit(label, attribute, changed)
+                else:
+                    finish(future)
+                    extracted += 1
+
+                bar.set_description(f"Archives {downloaded}/{len(urls)}")
+                bar.set_postfix(extracted=f"{extracted}/{len(urls)}")
+
+        # deferred months that no more recent archive delivered (e.g. it failed to download) come from the older archive
+        for label in sorted(deferred):
+            missing = {month: files for month, files in deferred[label].items()
+                       if manifest['months'].get(month, {'archive': ''})['archive'] < label}
+            if missing:
+                attribute, changed, _ = plan_extraction(archives[label], label, manifest, target_dir, [])
+                attribute = {month: files for month, files in attribute.items() if month in missing}
+                changed = {month: files for month, files in changed.items() if month in missing}
+                future = submit(label, attribute, changed)
+                wait([future])
+                finish(future)
+
+    # the archives are not needed anymore once the metropolitan files are extracted
+    for archive_path in archives.values():
+        os.remove(archive_path)
+        os.remove(archive_path + '.sha256')
+
+
+if __name__ == '__main__':
+
+    # Ask the user for input
+    print("For loading the dataset, you need to have 5-6 Gb of disk space available for this datasets (archives are streamed to disk, not kept in memory)\n")
+    user_input = ask_user_input()
+
+    # Check if the input is 'Y' or 'Yes'
+    if user_input.lower() in ['y', 'yes']:
+
+        print("Good, here we go... \n")
+
+        urls = [
+            'https://data.police.uk/data/archive/2016-12.zip',
+            'https://data.police.uk/data/archive/2019-12.zip',
+            'https://data.police.uk/data/archive/2022-12.zip',
+            'https://data.police.uk/data/archive/2024-03.zip'
+        ]
+
+        if LAST_AVAILABLE_DATASET is not None:
+            urls.append(LAST_AVAILABLE_DATASET)
+
+        # Define the target directory for extraction
+        target_dir = 'data/met_data'
+
+        # Ensure the target directory exists
+        os.makedirs(target_dir, exist_ok=True)
+
+        run_pipeline(urls, target_dir)
+
+        # Verify extraction by listing the extracted files (Optional)
+        extracted_files = os.listdir(target_dir)
+        print("Extracted files:", extracted_files, '\n')
+
+    else:
+        print("Dataloader was not run. Exiting shuting down.")
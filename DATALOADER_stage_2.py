@@ -1,10 +1,10 @@
 # imports 
 import os
-import subprocess
 
 import pandas as pd
 
 from functions.api_func import download_file
+from functions.build_func import build
 
 
 # Directory to save the file
@@ -42,13 +42,6 @@ if not os.path.exists(f'{save_directory}/PAS_T%26Cdashboard_to%20Q3%2023-24_Boro
     df = pd.read_csv(f'{path_to_PAS}_Borough.csv')
     df.to_csv(f'{path_to_PAS}_Borough.csv', index=False)
 
-# we run the preprocessor such to have needed csv
-if not os.path.exists('data/pas_data_ward_level/pre_final.csv'):
-    subprocess.run(["python", 'data_preprocessors/PAS_ward_level_preprocessor.py'])
-
-if not os.path.exists("data/met_data/met_crime_data.pkl"):
-    subprocess.run('data_preprocessors/MET_crime_preprocessor.py')
-
-if not os.path.exists('data/pas_data_ward_level/PAS_crime.csv'):
-    subprocess.run('data_preprocessors/PAS_crime_preprocessor.py')
+# we run the preprocessors whose outputs are missing or out of date (same as `python build.py`)
+build()
 
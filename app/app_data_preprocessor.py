@@ -18,17 +18,21 @@
 import os 
 import sys
 import inspect
-import subprocess
+import threading
 
 import pandas as pd 
-import geopandas as gpd
+import streamlit as st
 
 # modifying the root path for imports
 current = os.path.dirname(os.path.realpath(__file__))
 parent = os.path.dirname(current)
 sys.path.append(parent) 
 
-from config import questions_dict
+from config import questions_dict, recommendation_questions, PAS_WARD_LEVEL_FILES
+from functions.build_func import build
+from functions.borough_func import to_boroughs
+from functions.geo_func import NEIGHBOURHOODS_LOD, BOROUGHS_LOD, MAP_LOD, read_levels_of_detail
+from functions.store_func import MET_CRIME_STORE, PAS_WARD_LEVEL_STORE, PAS_CRIME_TABLE, open_met_crime_store, open_pas_ward_level_store
 
 SAVE_DIR = "data"
 
@@ -38,6 +42,14 @@ PATH_PERCEPTION = PATH_PERCEPTION[:-4]  # Remove ".csv" extension
 PATH_TO_PAS = os.path.join(SAVE_DIR, "PAS_T%26Cdashboard_to%20Q3%2023-24.xlsx")
 PATH_TO_PAS = PATH_TO_PAS[:-5]  # Remove ".xlsx" extension
 
+PATH_PAS_BOROUGH = 'data/pas_data_ward_level/pre_final.csv'
+
+# st.cache_resource replaced st.experimental_singleton in newer streamlit versions, requirements pin a version with only the latter
+cache_resource = getattr(st, 'cache_resource', None) or st.experimental_singleton
+
+_data_lock = threading.Lock()
+_build_lock = threading.Lock()
+
 
 def get_caller_script():
     """Helper function to determine the actual caller script name."""
@@ -49,24 +61,115 @@ def get_caller_script():
     return None
 
 
+def file_signature(paths: list) -> tuple:
+    """
+    (path, size, mtime) of every file behind `paths` (files or directories), missing files are left out.
+    The signature changes whenever a preprocessor rewrites one of the files.
+    """
+    signature = []
+    for path in paths:
+        files = [path] if not os.path.isdir(path) else sorted(os.path.join(root, name) for root, dirs, names in os.walk(path) for name in names)
+        for file in files:
+            if os.path.exists(file):
+                stat = os.stat(file)
+                signature.append((file, stat.st_size, stat.st_mtime_ns))
+    return tuple(signature)
+
+
+@cache_resource
+def _data_cache() -> dict:
+    # one dictionary per process, shared by all sessions and reruns: name -> (file signature, data)
+    return {}
+
+
+def cached_data(name: str, paths: list, load):
+    """
+    Returns the data of `load()`, which reads the files behind `paths`, from the process wide cache.
+    The data is loaded again only when one of the files changed (see file_signature), not on every rerun.
+
+    The cached dataframes are shared by all sessions, the pages must not modify them in place.
+    """
+    signature = file_signature(paths)
+    with _data_lock:
+        cache = _data_cache()
+        if name not in cache or cache[name][0] != signature:
+            cache[name] = (signature, load())
+        return cache[name][1]
+
+
+@cache_resource
+def _built_targets() -> set:
+    # the build targets that were brought up to date in this process
+    return set()
+
+
+def build_once(targets: list):
+    """
+    Brings the outputs of the build `targets` up to date (see functions/build_func.py) once per process, when the first page
+    needs them, instead of hashing their inputs on every rerun. clear_data_cache builds them again on the next use.
+    """
+    with _build_lock:
+        built = _built_targets()
+        missing = [target for target in targets if target not in built]
+        if missing:
+            status = build(missing)
+            # failed targets are tried again by the next page that needs them
+            built.update(target for target in missing if status.get(target) in ('built', 'up to date'))
+
+
+def clear_data_cache():
+    """Drops all cached data, e.g. after the data folder was replaced, the outputs are checked by the next build_once."""
+    with _data_lock:
+        _data_cache().clear()
+    with _build_lock:
+        _built_targets().clear()
+
+
 def preprocess_neighbourhoods():
-    geojson_path = os.path.join(SAVE_DIR, 'neighbourhoods_boundary.geojson')
-    neighbourhoods = gpd.read_file(geojson_path)
+    # the simplified boundaries are rebuilt when neighbourhoods_boundary.geojson changed (checked once per process)
+    build_once(['neighbourhoods'])
+
+    return cached_data('neighbourhoods', [NEIGHBOURHOODS_LOD], _load_neighbourhoods)
+
+
+def _load_neighbourhoods():
+    # the level of detail of the zoom of the maps, with borders shared between neighbourhoods
+    neighbourhoods = read_levels_of_detail(NEIGHBOURHOODS_LOD, MAP_LOD)
     
-    # Preprocess neighbourhoods data
-    neighbourhoods['borough'] = neighbourhoods['borough'].apply(lambda x: 'Westminster' if x == 'City of Westminster' else x)
+    neighbourhoods['borough'] = to_boroughs(neighbourhoods['borough'])
     
     return neighbourhoods
 
 
+def preprocess_boroughs():
+    """The boroughs dissolved from the simplified neighbourhoods, for the maps which only show borough data."""
+    build_once(['neighbourhoods'])
+
+    return cached_data('boroughs', [BOROUGHS_LOD], _load_boroughs)
+
+
+def _load_boroughs():
+    boroughs = read_levels_of_detail(BOROUGHS_LOD, MAP_LOD)
+    boroughs['borough'] = to_boroughs(boroughs['borough'])
+
+    # the maps show the name of the area in the tooltip
+    boroughs['name'] = boroughs['borough']
+
+    return boroughs
+
+
 
 def HOMEPAGE_data():
+    return cached_data('homepage', [f'{PATH_PERCEPTION}.csv', f'{PATH_TO_PAS}_MPS.csv', PATH_PAS_BOROUGH], _load_homepage_data)
+
+
+def _load_homepage_data():
     # additional perception data to be added to df_PAS
     df_perception = pd.read_csv(f'{PATH_PERCEPTION}.csv')
 
     # now read this files for future use in visualization
     df_PAS_MPS = pd.read_csv(f'{PATH_TO_PAS}_MPS.csv')
-    df_PAS_Borough = pd.read_csv(f'data/pas_data_ward_level/pre_final.csv')
+    df_PAS_Borough = pd.read_csv(PATH_PAS_BOROUGH)
 
     # exclude the questions about the perceived crime and ethnic leaning
     df_PAS_Borough = df_PAS_Borough[~df_PAS_Borough['Measure'].isin(['NNQ135A', 'NPQ135A', 'ReNQ147'])]
@@ -78,7 +181,7 @@ def HOMEPAGE_data():
     df_PAS_Borough['Total Proportion'] = df_PAS_Borough['Total Proportion'].astype(float)
     df_PAS_Borough = df_PAS_Borough.loc[:, ~df_PAS_Borough.columns.str.contains('^Unnamed')]
     df_PAS_Borough['Total Proportion'] = df_PAS_Borough['Total Proportion'].round(2)
-    df_PAS_Borough['Borough'] = df_PAS_Borough['Borough'].apply(lambda x: 'Westminster' if x == 'City of Westminster' else x)
+    df_PAS_Borough['Borough'] = to_boroughs(df_PAS_Borough['Borough'])
 
     # decode the question number in to category: 
     # Map the question names to their short descriptions
@@ -95,23 +198,23 @@ def HOMEPAGE_data():
 def CRIMEPAGE_data():
     ### LOAD THE DATA ###
 
-    if not os.path.exists("data/met_data/met_crime_data.pkl"):
-        subprocess.run('data_preprocessors/MET_crime_preprocessor.py')
+    # the crime store and the PAS crime table (and the ward level store it is made of) are rebuilt when missing or out of date
+    build_once(['met_crime', 'pas_crime'])
+
+    return cached_data('crimepage', [f'{PATH_TO_PAS}_Borough.csv', MET_CRIME_STORE], _load_crimepage_data)
 
-    if not os.path.exists('data/pas_data_ward_level/PAS_crime.csv'):
-        subprocess.run('data_preprocessors/PAS_crime_preprocessor.py')
 
-    df_PAS_Crime = pd.read_csv('data/pas_data_ward_level/PAS_crime.csv')
-    df_MET_Crime = pd.read_pickle('data/met_data/met_crime_data.pkl', )
+def _load_crimepage_data():
+    # only the path of the table, the page reads the borough and month it needs
+    df_PAS_Crime = PAS_CRIME_TABLE
+    # only the handle of the partitioned store, the page reads the month and columns it needs
+    df_MET_Crime = open_met_crime_store(MET_CRIME_STORE)
 
     df_PAS_Borough_Trust = pd.read_csv(f'{PATH_TO_PAS}_Borough.csv')
     df_PAS_Borough_Trust = pd.DataFrame(df_PAS_Borough_Trust[df_PAS_Borough_Trust['Measure'] == 'Trust MPS'])
 
-    df_PAS_Borough_Trust.loc[df_PAS_Borough_Trust['Borough'] == 'Richmond Upon Thames', 'Borough'] = 'Richmond upon Thames'
-    df_PAS_Borough_Trust.loc[df_PAS_Borough_Trust['Borough'] == 'Kensington & Chelsea', 'Borough'] = 'Kensington and Chelsea'
-    df_PAS_Borough_Trust.loc[df_PAS_Borough_Trust['Borough'] == 'Hammersmith & Fulham', 'Borough'] = 'Hammersmith and Fulham'
-    df_PAS_Borough_Trust.loc[df_PAS_Borough_Trust['Borough'] == 'Barking & Dagenham', 'Borough'] = 'Barking and Dagenham'
-    df_PAS_Borough_Trust['Borough'] = df_PAS_Borough_Trust['Borough'].apply(lambda x: 'Westminster' if x == 'City of Westminster' else x)
+    # the dashboard writes some boroughs differently than the other sources (see BOROUGH_ALIASES in config)
+    df_PAS_Borough_Trust['Borough'] = to_boroughs(df_PAS_Borough_Trust['Borough'])
 
     # Apply the conversion function to the Date column
     df_PAS_Borough_Trust['Date'] = df_PAS_Borough_Trust['Date'].apply(lambda date_str: date_str[:7])
@@ -120,138 +223,38 @@ def CRIMEPAGE_data():
 
 def RECOMMENDATIONPAGE_data():
 
-    #We define the paths to our CSV files for each year
-    csv_files = {
-        "20-21": r'data/pas_data_ward_level/PAS_ward_level_FY_20_21.csv',
-        "19-20": r'data/pas_data_ward_level/PAS_ward_level_FY_19_20.csv',
-        "18-19": r'data/pas_data_ward_level/PAS_ward_level_FY_18_19.csv',
-        "17-18": r'data/pas_data_ward_level/PAS_ward_level_FY_17_18.csv',
-        "15-17": r'data/pas_data_ward_level/PAS_ward_level_FY_15_17.csv'
-    }
-
-    #We define here the borough column name for each year
-    borough_column_mapping = {
-        "20-21": "Borough",
-        "19-20": "C2",
-        "18-19": "C2",
-        "17-18": "C2",
-        "15-17": "C2"
-    }
-
-    #We define here the ethnic group column name for each year
-    ethnic_group_column_mapping = {
-        "20-21": "ReNQ147",
-        "19-20": "NQ147r",
-        "18-19": "NQ147r",
-        "17-18": "NQ147r",
-        "15-17": "NQ147r"
-    }
-
-    #Define the questions and their corresponding statement and values (for the dashboard also)
-    questions = {
-        "Q13": {
-            "statement": "Q13: To what extent are you worried about crime in this area?",
-            "values": ["Very worried", "Fairly worried"]
-        },
-        "Q15": {
-            "statement": "Q15: To what extent are you worried about anti-social behaviour in this area?",
-            "values": ["Very worried", "Fairly worried"]
-        },
-        "Q60": {
-            "statement": "Q60: Taking everything into account, how good a job do you think the police IN YOUR AREA are doing?",
-            "values": ["Poor", "Very poor"]
-        },
-        "Q62A": {
-            "statement": "Q62A: To what extent do you agree with these statements about the police in your area?\
-            By 'your area' I mean within 15 minutes' walk from your home. \
-            They can be relied on to be there when you need them",
-            "values": ["Tend to disagree", "Strongly disagree"]
-        },
-        "Q62B": {
-            "statement": "Q62B: To what extent do you agree with these statements about the police in your area?\
-            By 'your area' I mean within 15 minutes' walk from your home. \
-            They would treat you with respect if you had contact with them for any reason.",
-            "values": ["Tend to disagree", "Strongly disagree"]
-        },
-        "Q62C": {
-            "statement": "Q62C: To what extent do you agree with these statements about the police in your area?\
-            By 'your area' I mean within 15 minutes' walk from your home. \
-            The police in your area treat everyone fairly regardless of who they are.",
-            "values": ["Tend to disagree", "Strongly disagree"]
-        },
-        "Q62D": {
-            "statement": "Q62D: To what extent do you agree with these statements about the police in this area?\
-            By 'this area' I mean within 15 minutes' walk from here. They can be relied on to deal with minor crimes",
-            "values": ["Tend to disagree", "Strongly disagree"]
-        },
-        "Q62E": {
-            "statement": "Q62E: To what extent do you agree with these statements about the police in this area?\
-            By 'this area' I mean within 15 minutes' walk from here. They understand the issues that affect this community",
-            "values": ["Tend to disagree", "Strongly disagree"]
-        },
-        "Q62TG": {
-            "statement": "Q62TG: To what extent do you agree with these statements about the police in your area? \
-            By 'your area' I mean within 15 minutes' walk from your home. \
-            The police in your area listen to the concerns of local people.",
-            "values": ["Tend to disagree","Strongly disagree"]
-        },
-        "A121": {
-            "statement": "A121: How confident are you that the Police in your area use their stop and search powers fairly?",
-            "values": ["Not very confident", "Not at all confident"]
-        }, 
-        "Q62F": {
-            "statement": "Q62F: To what extent do you agree with these statements about the police in your area?\
-            By 'your area' I mean within 15 minutes' walk from your home.\
-            They are dealing with the things that matter to people in this community",
-            "values": ["Tend to disagree","Strongly disagree"]
-        },
-        "Q62H": {
-            "statement": "Q62H: To what extent do you agree with these statements about the police in this area?\
-            By 'this area' I mean within 15 minutes' walk from here. The police in this area are helpful",
-            "values": ["Tend to disagree","Strongly disagree"]
-        },
-        "Q62TI": {
-            "statement": "Q62TI: To what extent do you agree with these statements about the police in this area?\
-            By 'this area' I mean within 15 minutes' walk from here. The police in this area are friendly and approachable",
-            "values": ["Tend to disagree","Strongly disagree"]
-        },
-        "Q62TJ": {
-            "statement": "Q62TJ: To what extent do you agree with these statements about the police in this area?\
-            By 'this area' I mean within 15 minutes' walk from here. The police in this area are easy to contact",
-            "values": ["Tend to disagree", "strongly disagree"]
-        },
-        "NQ135BD": {
-            "statement": "NQ135BD: To what extent do you agree or disagree with the following statements:\
-            The Metropolitan Police Service is an organisation that I can trust",
-            "values": ["Tend to disagree", "strongly disagree"]
-        },
-        "NQ135BH": {
-            "statement": "NQ135BH: To what extent do you agree or disagree that\
-            the police in your local area are sufficiently held accountable for their actions?",
-            "values": ["Tend to disagree", "strongly disagree"]
-        }
-    }
+    # the answers of every financial year are pre-aggregated by PAS_ward_level_preprocessor
+    build_once(['pas_ward_level'])
+
+    return cached_data('recommendationpage', [f'{PATH_TO_PAS}_Borough.csv', PAS_WARD_LEVEL_STORE], _load_recommendationpage_data)
+
+
+def _load_recommendationpage_data():
+    pas_answers = open_pas_ward_level_store(PAS_WARD_LEVEL_STORE)
+    years = list(PAS_WARD_LEVEL_FILES.keys())
 
     df_PAS_Borough_Trust = pd.read_csv(f'{PATH_TO_PAS}_Borough.csv')
     df_PAS_Borough_Trust = pd.DataFrame(df_PAS_Borough_Trust[df_PAS_Borough_Trust['Measure'] == 'Trust MPS'])
 
-    df_PAS_Borough_Trust.loc[df_PAS_Borough_Trust['Borough'] == 'Richmond Upon Thames', 'Borough'] = 'Richmond upon Thames'
-    df_PAS_Borough_Trust.loc[df_PAS_Borough_Trust['Borough'] == 'Kensington & Chelsea', 'Borough'] = 'Kensington and Chelsea'
-    df_PAS_Borough_Trust.loc[df_PAS_Borough_Trust['Borough'] == 'Hammersmith & Fulham', 'Borough'] = 'Hammersmith and Fulham'
-    df_PAS_Borough_Trust.loc[df_PAS_Borough_Trust['Borough'] == 'Barking & Dagenham', 'Borough'] = 'Barking and Dagenham'
+    # the dashboard writes some boroughs differently than the other sources (see BOROUGH_ALIASES in config)
+    df_PAS_Borough_Trust['Borough'] = to_boroughs(df_PAS_Borough_Trust['Borough'])
 
     # Apply the conversion function to the Date column
     df_PAS_Borough_Trust['Date'] = df_PAS_Borough_Trust['Date'].apply(lambda date_str: date_str[:7])
 
-    return csv_files, borough_column_mapping, ethnic_group_column_mapping, questions, df_PAS_Borough_Trust
+    return years, recommendation_questions, df_PAS_Borough_Trust, pas_answers
 
 
 
 def RESPPONSIVNESSPAGE_data():
+    return cached_data('responsivenesspage', [f'{PATH_TO_PAS}_MPS.csv', PATH_PAS_BOROUGH], _load_responsivenesspage_data)
+
+
+def _load_responsivenesspage_data():
     
     # now read this files for future use in visualization
     df_PAS_MPS = pd.read_csv(f'{PATH_TO_PAS}_MPS.csv')
-    df_PAS_Borough = pd.read_csv(f'data/pas_data_ward_level/pre_final.csv')
+    df_PAS_Borough = pd.read_csv(PATH_PAS_BOROUGH)
 
     # exclude the questions about the perceived crime and ethnic leaning
     df_PAS_Borough = df_PAS_Borough[~df_PAS_Borough['Measure'].isin(['NNQ135A', 'NPQ135A', 'ReNQ147'])]
@@ -1,5 +1,9 @@
+import json
 import folium
+import shapely
+import threading
 
+import numpy as np
 import pandas as pd
 import streamlit as st
 import geopandas as gpd
@@ -7,38 +11,216 @@ import plotly_express as px
 import branca.colormap as cm
 
 from typing import List
+from branca.element import MacroElement, Template
+from collections import OrderedDict
 from streamlit_folium import st_folium
 
 
 
+### CHOROPLETH MAPS OF ALL PAGES
+
+class ChoroplethCache:
+    """
+    GeoJSON payloads of a choropleth map of the neighbourhoods, one per (date, measure), replaces merging the neighbourhoods
+    with the data and serialising the full geometry on every rerun.
+
+    The geometry is serialised once, the values of every (date, measure) are kept as a small Series per borough,
+    and the last `max_payloads` payloads (GeoJSON FeatureCollections with the fill colour of every feature, parsed once)
+    are kept in an LRU cache.
+
+    Parameters
+    -
+    neighbourhoods - GeoDataFrame with the columns borough, name and geometry\n
+    df - data with the columns Borough, Date, `value` and `measure_column`\n
+    value - the column which is shown on the map\n
+    measure_column - the column of the measure, None when `df` holds a single measure (optional)\n
+    tolerance - simplify the geometry further with this tolerance in degrees, the geometry of preprocess_neighbourhoods is already simplified (optional)\n
+    max_payloads - how many payloads are kept (optional)
+    """
+    def __init__(self, neighbourhoods: gpd.GeoDataFrame, df: pd.DataFrame, value: str, measure_column: str = None,
+                 tolerance: float = None, max_payloads: int = 64):
+        self.neighbourhoods = neighbourhoods
+        self.df = df
+        self.value = value
+        self.measure_column = measure_column
+        self.max_payloads = max_payloads
+
+        self.boroughs = neighbourhoods['borough'].to_numpy()
+        self.names = neighbourhoods['name'].to_numpy()
+        geometry = np.asarray(neighbourhoods.geometry.values)
+        if tolerance is not None:
+            geometry = shapely.simplify(geometry, tolerance, preserve_topology=True)
+        self.geometry_json = shapely.to_geojson(geometry)
+
+        # grouped by the date alone without a measure, such that the keys are the dates in every pandas version
+        keys = 'Date' if measure_column is None else ['Date', measure_column]
+        self.values = {key: group.drop_duplicates('Borough').set_index('Borough')[value]
+                       for key, group in df.groupby(keys)}
+
+        self.payloads = OrderedDict()
+        self.lock = threading.Lock()
+
+    def payload(self, date: str, measure: str = None) -> dict:
+        """
+        The GeoJSON FeatureCollection of `date` and `measure`, only neighbourhoods with data are included.
+        The payload is shared by all reruns and sessions, it must not be modified.
+        """
+        key = date if self.measure_column is None else (date, measure)
+        with self.lock:
+            if key in self.payloads:
+                self.payloads.move_to_end(key)
+                return self.payloads[key]
+
+        # folium would parse a string payload on every rerun, it gets the parsed FeatureCollection instead
+        payload = json.loads(self.build_payload(key, date, measure))
+        with self.lock:
+            self.payloads[key] = payload
+            while len(self.payloads) > self.max_payloads:
+                self.payloads.popitem(last=False)
+        return payload
+
+    def build_payload(self, key, date: str, measure: str) -> str:
+        values = self.values.get(key, pd.Series(dtype=float))
+        matched = np.flatnonzero(np.isin(self.boroughs, values.index))
+        feature_values = values.reindex(self.boroughs[matched]).to_numpy(dtype=float)
+
+        colours = {}
+        finite = feature_values[np.isfinite(feature_values)]
+        if len(finite):
+            linear = cm.LinearColormap(["red", "yellow", "green"], vmin=finite.min(), vmax=finite.max())
+            # the boroughs share a handful of values, every colour is computed once
+            colours = {v: linear(v) for v in np.unique(finite)}
+
+        features = []
+        for i, v in zip(matched, feature_values):
+            properties = {'borough': self.boroughs[i], 'name': self.names[i], 'Borough': self.boroughs[i], 'Date': date,
+                          self.value: None if np.isnan(v) else float(v), 'fillColor': colours.get(v, 'grey')}
+            if self.measure_column is not None:
+                properties[self.measure_column] = measure
+            features.append(f'{{"type": "Feature", "id": "{i}", "properties": {json.dumps(properties)}, "geometry": {self.geometry_json[i]}}}')
+
+        return '{"type": "FeatureCollection", "features": [' + ', '.join(features) + ']}'
+
+
+_choropleth_caches = OrderedDict()
+_choropleth_lock = threading.Lock()
+
+
+def get_choropleth_cache(neighbourhoods_: gpd.GeoDataFrame, df: pd.DataFrame, value: str, measure_column: str = None) -> ChoroplethCache:
+    """
+    The ChoroplethCache of `df`, shared by all reruns and sessions as long as the same (cached) frames are passed,
+    see cached_data in app/app_data_preprocessor.py.
+    """
+    key = (id(neighbourhoods_), id(df), value, measure_column)
+    with _choropleth_lock:
+        cache = _choropleth_caches.get(key)
+        if cache is None or cache.neighbourhoods is not neighbourhoods_ or cache.df is not df:
+            cache = _choropleth_caches[key] = ChoroplethCache(neighbourhoods_, df, value, measure_column)
+            # caches of frames that were reloaded are dropped
+            while len(_choropleth_caches) > 8:
+                _choropleth_caches.popitem(last=False)
+        return cache
+
+
+class ChoroplethStyle(MacroElement):
+    """
+    Styles the features of its parent GeoJson layer in the browser with the `fillColor` property of every feature
+    (see ChoroplethCache), replaces a folium style_function which is called in Python for every feature on every rerun.
+    """
+    _template = Template(u"""
+        {% macro script(this, kwargs) %}
+        {{ this._parent.get_name() }}.setStyle(function(feature) {
+            return Object.assign({{ this.style|tojson }}, {fillColor: feature.properties.fillColor});
+        });
+        {% endmacro %}
+        """)
+
+    def __init__(self, style: dict = None):
+        super().__init__()
+        self._name = 'ChoroplethStyle'
+        self.style = style or {"color": "black", "weight": 1, "dashArray": "5, 5"}
+
+
+def choropleth_layer(payload: dict, value: str) -> folium.GeoJson:
+    """
+    The GeoJson layer of a payload of ChoroplethCache, coloured in the browser (see ChoroplethStyle).
+
+    Examples
+    -
+    ```python
+    choropleth_layer(get_choropleth_cache(neighbourhoods, df, 'Proportion').payload(date), 'Proportion').add_to(m)
+    ```
+    """
+    geojson_layer = folium.features.GeoJson(
+            data=payload,
+            tooltip=folium.features.GeoJsonTooltip(fields=['borough', 'name', value],
+                                                   aliases=['Borough', 'Location', 'Proportion']))
+    geojson_layer.add_child(ChoroplethStyle())
+    return geojson_layer
+
+
 
 # DEFINE THE FUNCTIONS FOR HOMEPAGE 
+
+# st.fragment reruns only the decorated function when a widget inside it changes (e.g. a click on the map),
+# streamlit versions without fragments rerun the whole page
+fragment = getattr(st, 'fragment', None) or getattr(st, 'experimental_fragment', None) or (lambda function: function)
+
+
+class BoroughIndex:
+    """
+    The rows of the borough data grouped once per borough and measure (borough -> measure -> rows sorted by date),
+    the charts of a selected borough look up their rows instead of filtering the whole frame on every click.
+
+    Parameters
+    -
+    df - data with the columns Borough, Measure and Date (HOMEPAGE_data)
+    """
+    def __init__(self, df: pd.DataFrame):
+        self.df = df
+        self.groups = {}
+        for (borough, measure), group in df.groupby(['Borough', 'Measure'], observed=True, sort=False):
+            self.groups.setdefault(borough, {})[measure] = group.sort_values('Date').set_index('Date', drop=False)
+
+    def series(self, borough: str, measures: List[str]) -> pd.DataFrame:
+        """The rows of `borough` and `measures`, sorted by date."""
+        groups = self.groups.get(borough, {})
+        frames = [groups[measure] for measure in measures if measure in groups]
+        return pd.concat(frames, ignore_index=True) if frames else self.df.iloc[:0]
+
+    def row(self, borough: str, measure: str, date: str) -> pd.DataFrame:
+        """The rows of `borough` and `measure` on `date` (empty when there is none)."""
+        group = self.groups.get(borough, {}).get(measure)
+        if group is None or date not in group.index:
+            return self.df.iloc[:0]
+        return group.loc[[date]].reset_index(drop=True)
+
+
+_borough_indexes = OrderedDict()
+_borough_index_lock = threading.Lock()
+
+
+def get_borough_index(df: pd.DataFrame) -> BoroughIndex:
+    """The BoroughIndex of `df`, built once per (cached) frame like get_choropleth_cache."""
+    with _borough_index_lock:
+        index = _borough_indexes.get(id(df))
+        if index is None or index.df is not df:
+            index = _borough_indexes[id(df)] = BoroughIndex(df)
+            while len(_borough_indexes) > 4:
+                _borough_indexes.popitem(last=False)
+        return index
+
     
 def display_map_homepage(df: pd.DataFrame, date: str, measure: str, neighbourhoods_):
-        
-    # Filter data based on selected date
-    filtered_data = df[(df['Measure'] == measure) & (df['Date'] == date)]
-
-    # Merge the filtered data with the boroughs data
-    merged_data = gpd.GeoDataFrame(neighbourhoods_.merge(filtered_data, left_on='borough', right_on='Borough'))
 
-    # create the color map 
-    linear = cm.LinearColormap(["red", "yellow", "green"], vmin=min(merged_data['Total Proportion']), vmax=max(merged_data['Total Proportion']))
+    # the payload of the selected date and measure (built once, with the fill colours)
+    payload = get_choropleth_cache(neighbourhoods_, df, 'Total Proportion', 'Measure').payload(date, measure)
 
     # create the map
     m = folium.Map(location=[51.5074, -0.1278], tiles="Cartodb Positron", zoom_start=10.5)
 
-    # geojson layer for the map
-    geojson_layer = folium.features.GeoJson(
-            data=merged_data,
-            style_function=lambda feature: {
-                "fillColor": linear(feature['properties']['Total Proportion']),
-                "color": "black",
-                "weight": 1,
-                "dashArray": "5, 5",
-            },
-            tooltip=folium.features.GeoJsonTooltip(fields=['borough', 'name', 'Total Proportion'],
-                                                   aliases=['Borough', 'Location', 'Proportion']))
+    # geojson layer for the map, coloured in the browser
+    geojson_layer = choropleth_layer(payload, 'Total Proportion')
     # add layer to the map
     geojson_layer.add_to(m)
 
@@ -48,8 +230,8 @@ def display_map_homepage(df: pd.DataFrame, date: str, measure: str, neighbourhoo
 
 
 def display_trend_measure_borough(df_: pd.DataFrame, borough_: str = None, measures_: List[str] = ['worries about crime near citizens']):
-    # filter the data only for need measure and borough
-    filtered_data = df_[(df_['Borough'] == borough_) & (df_['Measure'].isin(measures_))]
+    # the time series of the borough, looked up in the index of the data
+    filtered_data = get_borough_index(df_).series(borough_, measures_)
     fig = px.line(filtered_data, x='Date', y='Total Proportion', color='Measure', title=f'Trend for measures in {borough_}')
     fig.update_layout(xaxis_rangeslider_visible=True)
 
@@ -58,8 +240,8 @@ def display_trend_measure_borough(df_: pd.DataFrame, borough_: str = None, measu
 
 
 def display_box_ethnicity(df_: pd.DataFrame, borough_: str, measure_: str, date: str):
-    # Filter the data
-    filtered_data = df_[(df_['Borough'] == borough_) & (df_['Measure'] == measure_) & (df_['Date'] == date)]
+    # the row of the borough, measure and date
+    filtered_data = get_borough_index(df_).row(borough_, measure_, date)
     
     # Extract proportions for each ethnicity
     proportions = filtered_data[['White_British_Proportion', 'White_Other_Proportion', 'Black_Proportion', 'Asian_Proportion', 'Mixed_Proportion', 'Other_Proportion']].values.flatten()
@@ -89,7 +271,7 @@ def display_box_ethnicity(df_: pd.DataFrame, borough_: str, measure_: str, date:
 ### DEFINE FUNCTIONS FOR CRIMEPAGE
 
 def plot_barchart(df: pd.DataFrame, locat: str):
-    fig = px.bar(df.groupby(by='Crime type').count().reset_index()[['Crime type','Month']].rename({'Month':'count'}, axis=1).sort_values(by='count', ascending=False), x='Crime type', y='count', title=f'Crimes in {locat}')
+    fig = px.bar(df.groupby(by='Crime type', observed=True).count().reset_index()[['Crime type','Month']].rename({'Month':'count'}, axis=1).sort_values(by='count', ascending=False), x='Crime type', y='count', title=f'Crimes in {locat}')
 
     # Update the layout to increase the title text size
     fig.update_layout(
@@ -103,30 +285,15 @@ def plot_barchart(df: pd.DataFrame, locat: str):
     st.plotly_chart(fig, use_container_width=True)
 
 def display_map_crimepage(df: pd.DataFrame, date: str, measure: str, neighbourhoods_):
-        
-    # Filter data based on selected date
-    filtered_data = df[df['Date'] == date]
-
-    # Merge the filtered data with the boroughs data
-    merged_data = gpd.GeoDataFrame(neighbourhoods_.merge(filtered_data, left_on='borough', right_on='Borough'))
 
-    # create the color map 
-    linear = cm.LinearColormap(["red", "yellow", "green"], vmin=min(merged_data['Proportion']), vmax=max(merged_data['Proportion']))
+    # the payload of the selected date (`df` holds only the `measure`)
+    payload = get_choropleth_cache(neighbourhoods_, df, 'Proportion').payload(date)
 
     # create the map
     m = folium.Map(location=[51.5074, -0.1278], tiles="Cartodb Positron", zoom_start=10.5)
 
-    # geojson layer for the map
-    geojson_layer = folium.features.GeoJson(
-            data=merged_data,
-            style_function=lambda feature: {
-                "fillColor": linear(feature['properties']['Proportion']),
-                "color": "black",
-                "weight": 1,
-                "dashArray": "5, 5",
-            },
-            tooltip=folium.features.GeoJsonTooltip(fields=['borough', 'name', 'Proportion'],
-                                                   aliases=['Borough', 'Location', 'Proportion']))
+    # geojson layer for the map, coloured in the browser
+    geojson_layer = choropleth_layer(payload, 'Proportion')
     # add layer to the map
     geojson_layer.add_to(m)
 
@@ -143,25 +310,26 @@ def convert_date_format(date_str):
 ### FUNCTIONS FOR RECOMMENDATIONS PAGE
 
 #A function to calculate percentages for each ethnic group and borough
-def calculate_percentages_recpage(df, question, values, ethnic_group, borough_column, ethnic_column):
-    if question not in df.columns:
-        return pd.DataFrame(columns=[borough_column, ethnic_column, 'Percentage'])
-    
+def calculate_percentages_recpage(counts, values, ethnic_group):
+    """
+    Calculates the percentage of respondents per borough and ethnic group that gave one of `values` as answer,
+    from the answer counts of one question and year (see read_pas_answers in functions/store_func.py).
+    """
+    if counts.empty:
+        return pd.DataFrame(columns=['Borough', 'ReNQ147', 'Percentage'])
+
+    counts = counts.rename(columns={'Ethnicity': 'ReNQ147'})
     if ethnic_group != 'All':
-        df = df[df[ethnic_column] == ethnic_group]
-    
-    #We filter here the dataframe based on the question values
-    filtered_df = df[df[question].isin(values)]
-    
+        counts = counts[counts['ReNQ147'] == ethnic_group]
+
     #This is to count the total responses and filtered responses for each ethnic group within each borough
-    total_counts = df.groupby([borough_column, ethnic_column]).size().rename('Total')
-    disagree_counts = filtered_df.groupby([borough_column, ethnic_column]).size().rename('Disagree')
-    
+    total_counts = counts.groupby(['Borough', 'ReNQ147'], observed=True)['Count'].sum().rename('Total')
+    disagree_counts = counts[counts['Answer'].isin(values)].groupby(['Borough', 'ReNQ147'], observed=True)['Count'].sum().rename('Disagree')
+
     #Combine and calculate percentages
     combined_counts = pd.concat([total_counts, disagree_counts], axis=1).fillna(0)
     combined_counts['Percentage'] = (combined_counts['Disagree'] / combined_counts['Total']) * 100
     combined_counts['Percentage'] = combined_counts['Percentage'].round(2)
     combined_counts = combined_counts.reset_index()
-    
-    return combined_counts[[borough_column, ethnic_column, 'Percentage']]
 
+    return combined_counts[['Borough', 'ReNQ147', 'Percentage']]
@@ -1,7 +1,6 @@
 # imports 
 import os
 import sys
-import subprocess
 
 import pandas as pd
 import streamlit as st
@@ -13,15 +12,14 @@ sys.path.append(parent)
 
 # custom imports 
 from functions.api_func import download_file
-from app.app_func import display_map_homepage, display_box_ethnicity, display_trend_measure_borough
-from app_data_preprocessor import HOMEPAGE_data, preprocess_neighbourhoods
+from app.app_func import display_map_homepage, display_box_ethnicity, display_trend_measure_borough, fragment
+from app.app_data_preprocessor import HOMEPAGE_data, preprocess_neighbourhoods, build_once
 
 
 ### LOAD THE DATA IF IT IS NOT INSTALLED
 
-# we run the preprocessor such to have needed csv
-if not os.path.exists('data/pas_data_ward_level/pre_final.csv'):
-    subprocess.run(["python", 'data_preprocessors/PAS_ward_level_preprocessor.py'])
+# we run the preprocessor such to have needed csv (rebuilt when the survey files changed)
+build_once(['pas_ward_level'])
 
 # Directory to save the file
 save_directory = "data"
@@ -91,17 +89,23 @@ def run_app():
     selected_measure = st.selectbox('Select Measure', options=available_measures)#, label_visibility='collapsed')
     selected_measures = st.multiselect('Select Measures for line plot', options=available_measures, default=selected_measure)#, label_visibility='collapsed')
 
+    display_map_and_charts(selected_date, selected_measure, selected_measures)
+
+
+@fragment
+def display_map_and_charts(selected_date, selected_measure, selected_measures):
+    """
+    The map and the charts of the borough clicked on the map. A click reruns only this function, the map payload
+    and the rows of the charts are cached (see ChoroplethCache and BoroughIndex in app/app_func.py).
+    """
     st_map = display_map_homepage(df_PAS_Borough, selected_date, selected_measure, neighbourhoods_=neighbourhoods)
 
-    # read the callback from map and return them
-    neighbourhood = ''
-    poly = ''
+    # read the callback from map, the selected borough is kept in the session
     if st_map['last_active_drawing']:
-        neighbourhood = st_map['last_active_drawing']['properties']['name']
-        poly = st_map['last_active_drawing']['geometry']['coordinates']
-        borough = st_map['last_active_drawing']['properties']['Borough']
-        measure = st_map['last_active_drawing']['properties']['Measure']
+        st.session_state['selected_borough'] = st_map['last_active_drawing']['properties']['Borough']
 
+    borough = st.session_state.get('selected_borough')
+    if borough:
         display_trend_measure_borough(df_=df_PAS_Borough, borough_=borough, measures_=selected_measures)
         display_box_ethnicity(df_=df_PAS_Borough, borough_=borough, measure_=selected_measure, date=selected_date)
 
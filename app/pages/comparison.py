@@ -2,12 +2,9 @@
 import os
 import sys
 import folium
-import subprocess
 
 import pandas as pd
 import streamlit as st
-import geopandas as gpd
-import branca.colormap as cm
 
 from streamlit_folium import st_folium
 
@@ -17,17 +14,16 @@ parent = os.path.dirname(current)
 sys.path.append(parent)
 
 # custom imports
-from config import questions_dict
 from functions.api_func import download_file
-from app.app_data_preprocessor import preprocess_neighbourhoods
+from app.app_func import get_choropleth_cache, choropleth_layer
+from app.app_data_preprocessor import HOMEPAGE_data, preprocess_neighbourhoods, build_once
 
 # LOAD THE DATA
 
 neighbourhoods = preprocess_neighbourhoods()
 
-# we run the preprocessor such to have needed csv
-if not os.path.exists('data/pas_data_ward_level/pre_final.csv'):
-    subprocess.run(["python", 'data_preprocessors/PAS_prerocess_ward_level.py'])
+# we run the preprocessor such to have needed csv (rebuilt when the survey files changed)
+build_once(['pas_ward_level'])
 
 # Directory to save the file
 save_directory = "data"
@@ -64,60 +60,22 @@ if not os.path.exists(f'{save_directory}/PAS_T%26Cdashboard_to%20Q3%2023-24_Boro
     df = pd.read_csv(f'{path_to_PAS}_Borough.csv')
     df.to_csv(f'{path_to_PAS}_Borough.csv', index=False)
 
-# additional perception data to be added to df_PAS
-df_perception = pd.read_csv(f'{path_perception}.csv')
-
-# now read this files for future use in visualization
-df_PAS_MPS = pd.read_csv(f'{path_to_PAS}_MPS.csv')
-df_PAS_Borough = pd.read_csv(f'data/pas_data_ward_level/pre_final.csv')
-
-# exclude the questions about the perceived crime and ethnic leaning
-df_PAS_Borough = df_PAS_Borough[~df_PAS_Borough['Measure'].isin(['NNQ135A', 'NPQ135A', 'ReNQ147'])]
-
-# Preprocess the data fro MPS
-df_PAS_MPS['Date'] = df_PAS_MPS['Date'].apply(lambda x: x[:4])
-
-# Preprocess the data for Borough
-df_PAS_Borough['Total Proportion'] = df_PAS_Borough['Total Proportion'].astype(float)
-df_PAS_Borough = df_PAS_Borough.loc[:, ~df_PAS_Borough.columns.str.contains('^Unnamed')]
-df_PAS_Borough['Borough'] = df_PAS_Borough['Borough'].apply(lambda x: 'Westminster' if x == 'City of Westminster' else x)
-df_PAS_Borough['Total Proportion'] = df_PAS_Borough['Total Proportion'].round(2)
-
-# decode the question number in to category: 
-# Map the question names to their short descriptions
-question_descriptions = {key: value[1] for key, value in questions_dict.items()}
-
-# Rename the 'Measure' column in results_df using the question descriptions
-df_PAS_Borough['Measure'] = df_PAS_Borough['Measure'].map(question_descriptions)
+# the same frames as on the home page, read once per process and shared (see cached_data)
+df_perception, df_PAS_MPS, df_PAS_Borough, question_descriptions = HOMEPAGE_data()
 
 
 # DEFINE THE FUNCTIONS 
     
 def display_map(df: pd.DataFrame, date: str, measure: str, map_key: str):
-        
-    # Filter data based on selected date
-    filtered_data = df[(df['Measure'] == measure) & (df['Date'] == date)]
-
-    # Merge the filtered data with the boroughs data
-    merged_data = gpd.GeoDataFrame(neighbourhoods.merge(filtered_data, left_on='borough', right_on='Borough'))
 
-    # create the color map 
-    linear = cm.LinearColormap(["red", "yellow", "green"], vmin=min(merged_data['Total Proportion']), vmax=max(merged_data['Total Proportion']))
+    # the same payloads as the map of the home page (see ChoroplethCache)
+    payload = get_choropleth_cache(neighbourhoods, df, 'Total Proportion', 'Measure').payload(date, measure)
 
     # create the map
     m = folium.Map(location=[51.5074, -0.1278], tiles="Cartodb Positron", zoom_start=10.5)
 
-    # geojson layer for the map
-    geojson_layer = folium.features.GeoJson(
-            data=merged_data,
-            style_function=lambda feature: {
-                "fillColor": linear(feature['properties']['Total Proportion']),
-                "color": "black",
-                "weight": 1,
-                "dashArray": "5, 5",
-            },
-            tooltip=folium.features.GeoJsonTooltip(fields=['borough', 'name', 'Total Proportion'],
-                                                   aliases=['Borough', 'Location', 'Proportion']))
+    # geojson layer for the map, coloured in the browser
+    geojson_layer = choropleth_layer(payload, 'Total Proportion')
     # add layer to the map
     geojson_layer.add_to(m)
 
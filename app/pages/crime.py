@@ -19,7 +19,8 @@ sys.path.append(parent)
 
 # custom imports 
 from app.app_func import display_map_crimepage, plot_barchart
-from app.app_data_preprocessor import CRIMEPAGE_data, preprocess_neighbourhoods 
+from app.app_data_preprocessor import CRIMEPAGE_data, preprocess_boroughs 
+from functions.store_func import read_met_crime, read_pas_crime
 
 st.set_page_config(
     layout='wide',
@@ -30,7 +31,8 @@ st.set_page_config(
 
 ### RUN THE APPLICATION ### 
 
-neighbourhoods = preprocess_neighbourhoods()
+# the map only shows borough data, so it is drawn with the dissolved boroughs
+neighbourhoods = preprocess_boroughs()
 df_PAS_Crime, df_MET_Crime, df_PAS_Borough_Trust = CRIMEPAGE_data()
 
 st.title("Crime Data in London")
@@ -48,18 +50,14 @@ poly = ''
 if st_map['last_active_drawing']:
     borough = st_map['last_active_drawing']['properties']['Borough']
 
-    df_MET_Crime = df_MET_Crime[(df_MET_Crime['LSOA name'].str.contains(borough, na=False)) & (df_MET_Crime['Month'] == selected_date)].reset_index()
-    df_PAS_Crime = df_PAS_Crime[(df_PAS_Crime['Borough'] == borough) & (df_PAS_Crime['Date'] == selected_date)].reset_index()
-
-    # Convert the dictionary into a DataFrame
-    try:
-        data = eval(df_PAS_Crime['Crime type'].loc[0])
-        # Extracting keys and values from the dictionary
-        df = pd.DataFrame(list(data.items()), columns=['Category', 'Count'])
+    # read only the selected month and borough and the columns the charts need from the crime store
+    df_MET_Crime = read_met_crime(df_MET_Crime, columns=['Month', 'Borough', 'Crime type'], months=[selected_date], boroughs=[borough])
+    df_PAS_Crime = read_pas_crime(df_PAS_Crime, boroughs=[borough], dates=[selected_date])
 
+    if not df_PAS_Crime.empty:
         # Creating a bar chart using Plotly Express
-        fig = px.bar(df, x='Category', y='Count', orientation='v', title=f'In {borough} People Are Afraid of:', 
-                    labels={'Count': 'Counts', 'Category': 'Categories'})
+        fig = px.bar(df_PAS_Crime, x='Concern', y='Count', orientation='v', title=f'In {borough} People Are Afraid of:', 
+                    labels={'Count': 'Counts', 'Concern': 'Categories'})
         
         # Update the layout to increase the title text size
         fig.update_layout(
@@ -73,7 +71,7 @@ if st_map['last_active_drawing']:
 
         # Display the bar chart in Streamlit
         st.plotly_chart(fig, use_container_width=True)
-    except:
+    else:
         st.warning('There is no PAS data for this time period, but there is Crime data from MET for this period')
 
     plot_barchart(df_MET_Crime, borough)
@@ -14,7 +14,8 @@ parent = os.path.dirname(current)
 sys.path.append(parent) 
 
 from app.app_func import calculate_percentages_recpage, display_map_crimepage
-from app.app_data_preprocessor import RECOMMENDATIONPAGE_data, preprocess_neighbourhoods
+from app.app_data_preprocessor import RECOMMENDATIONPAGE_data, preprocess_boroughs
+from functions.store_func import read_pas_answers
 
 
 
@@ -25,21 +26,25 @@ st.set_page_config(
     initial_sidebar_state='expanded'
 )
 
-neighbourhoods = preprocess_neighbourhoods()
+# the map only shows borough data, so it is drawn with the dissolved boroughs
+neighbourhoods = preprocess_boroughs()
 
-csv_files, borough_column_mapping, ethnic_group_column_mapping, questions, df_PAS_Borough_Trust = RECOMMENDATIONPAGE_data()
+years, questions, df_PAS_Borough_Trust, pas_answers = RECOMMENDATIONPAGE_data()
 
 # Initialize the Streamlit app
 st.title("Borough Recommendation System")
 
 # Year selection dropdown
-selected_year = st.sidebar.selectbox('Select Year', options=list(csv_files.keys()), index=0)
+selected_year = st.sidebar.selectbox('Select Year', options=years, index=0)
 
 # Question selection dropdown
 selected_question = st.sidebar.selectbox('Select Question', options=[q for q in questions.keys()], format_func=lambda q: questions[q]['statement'])
 
+# Load the pre-aggregated answer counts of the selected year and question
+df = read_pas_answers(pas_answers, years=[selected_year], measures=[selected_question])
+
 # Ethnicity selection dropdown
-selected_ethnicity = st.sidebar.selectbox('Select Ethnicity', options=['All'] + list(pd.read_csv(csv_files[selected_year])[ethnic_group_column_mapping[selected_year]].dropna().unique()))
+selected_ethnicity = st.sidebar.selectbox('Select Ethnicity', options=['All'] + list(df['Ethnicity'].dropna().unique()))
 
 # Top/Bottom selection radio buttons
 top_bottom = st.sidebar.radio('Top/Bottom Percentages', options=['top', 'bottom'], index=0)
@@ -55,26 +60,14 @@ elif selected_year == '17-18':
 elif selected_year == '15-17':
     selected_date = '2017-12'
 
-# Load the data for the selected year
-df = pd.read_csv(csv_files[selected_year])
-
 st_map = display_map_crimepage(df=df_PAS_Borough_Trust, date=selected_date, measure='Trust MPS', neighbourhoods_=neighbourhoods)
 
 
 if st_map['last_active_drawing']:
     selected_borough = st_map['last_active_drawing']['properties']['Borough']
 
-
-    # Rename the borough and ethnic group columns if necessary
-    borough_column = borough_column_mapping[selected_year]
-    ethnic_column = ethnic_group_column_mapping[selected_year]
-    if borough_column != 'Borough':
-        df = df.rename(columns={borough_column: 'Borough'})
-    if ethnic_column != 'ReNQ147':
-        df = df.rename(columns={ethnic_column: 'ReNQ147'})
-
     # Calculate percentages based on selected question, borough, and ethnicity
-    percentages_df = calculate_percentages_recpage(df, selected_question, questions[selected_question]['values'], selected_ethnicity, 'Borough', 'ReNQ147')
+    percentages_df = calculate_percentages_recpage(df, questions[selected_question]['values'], selected_ethnicity)
 
     if percentages_df.empty:
         st.write("Question not available for the selected year.")
@@ -0,0 +1,25 @@
+# imports
+import sys
+import argparse
+
+from functions.build_func import BUILD_GRAPH, build
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Runs the data preprocessors whose outputs are missing or out of date, independent preprocessors run at the same time.')
+    parser.add_argument('targets', nargs='*', help=f"stages to build together with the stages they depend on (default: all), one of {[node.name for node in BUILD_GRAPH]}")
+    parser.add_argument('--force', action='store_true', help='rebuild the stages even if they are up to date')
+    parser.add_argument('--jobs', type=int, default=None, help='maximum number of stages that run at the same time')
+    parser.add_argument('--list', action='store_true', help='list the stages with their inputs and outputs and exit')
+    args = parser.parse_args()
+
+    if args.list:
+        for node in BUILD_GRAPH:
+            print(f"{node.name}\n  script:  {node.script}\n  inputs:  {', '.join(node.inputs[1:])}\n  outputs: {', '.join(node.outputs)}")
+        sys.exit(0)
+
+    status = build(args.targets or None, force=args.force, max_workers=args.jobs)
+    for name, result in status.items():
+        print(f'{name}: {result}')
+
+    sys.exit(1 if 'failed' in status.values() else 0)
@@ -3,6 +3,37 @@ here you have to specify the path to your data folder
 """
 path_to_crime_data = "data/met_data"
 
+"""
+here you can specify where the police archives are downloaded to before extraction (they are removed after extraction)
+"""
+path_to_archives = "data/archives"
+
+"""
+here you can specify how many police archives DATALOADER_stage_1 downloads at the same time
+"""
+MAX_PARALLEL_DOWNLOADS = 4
+
+"""
+here you can specify where the responses of the data.police.uk API are cached, how large the cache may grow (in MB)
+and how long (in seconds) responses of recent months are kept (older months do not change and are kept until evicted)
+"""
+path_to_http_cache = "data/http_cache"
+HTTP_CACHE_MAX_MB = 1024
+HTTP_CACHE_TTL = 24 * 60 * 60
+
+"""
+here you can specify after how many days the outcomes of crimes that are still open (e.g. under investigation) are requested again,
+outcomes of closed cases are requested only once
+"""
+OUTCOME_REFRESH_DAYS = 30
+
+"""
+here you can specify the hexagonal grid the street crimes are counted in (see MET_hex_preprocessor): the side (in metres)
+of the hexagons at resolution 0 and the resolutions that are counted, every next resolution halves the side
+"""
+HEX_BASE_SIZE = 4000
+HEX_RESOLUTIONS = [0, 1, 2, 3, 4, 5]
+
 """
 when release or partial submission set to False
 """
@@ -17,6 +48,66 @@ LAST_AVAILABLE_DATASET = None
 
 # global variables
 
+# number of months every data.police.uk archive contains (a rolling window ending at the month of the archive)
+ARCHIVE_WINDOW_MONTHS = 36
+
+# rate limit of the data.police.uk API: 15 requests per second on average with bursts of up to 30 requests
+API_RATE_LIMIT = 15
+API_BURST = 30
+
+# months older than this many months are not revised anymore by data.police.uk, their responses never expire in the cache
+API_IMMUTABLE_AFTER_MONTHS = 3
+
+# outcome categories after which a case can still change, a crime whose last outcome is one of these is not final
+OPEN_OUTCOME_CATEGORIES = {'under-investigation', 'awaiting-court-result', 'charged', 'sent-to-crown-court', 'status-update-unavailable'}
+
+# the London boroughs with their ONS codes and canonical names
+BOROUGHS = {
+    'E09000001': 'City of London',
+    'E09000002': 'Barking and Dagenham',
+    'E09000003': 'Barnet',
+    'E09000004': 'Bexley',
+    'E09000005': 'Brent',
+    'E09000006': 'Bromley',
+    'E09000007': 'Camden',
+    'E09000008': 'Croydon',
+    'E09000009': 'Ealing',
+    'E09000010': 'Enfield',
+    'E09000011': 'Greenwich',
+    'E09000012': 'Hackney',
+    'E09000013': 'Hammersmith and Fulham',
+    'E09000014': 'Haringey',
+    'E09000015': 'Harrow',
+    'E09000016': 'Havering',
+    'E09000017': 'Hillingdon',
+    'E09000018': 'Hounslow',
+    'E09000019': 'Islington',
+    'E09000020': 'Kensington and Chelsea',
+    'E09000021': 'Kingston upon Thames',
+    'E09000022': 'Lambeth',
+    'E09000023': 'Lewisham',
+    'E09000024': 'Merton',
+    'E09000025': 'Newham',
+    'E09000026': 'Redbridge',
+    'E09000027': 'Richmond upon Thames',
+    'E09000028': 'Southwark',
+    'E09000029': 'Sutton',
+    'E09000030': 'Tower Hamlets',
+    'E09000031': 'Waltham Forest',
+    'E09000032': 'Wandsworth',
+    'E09000033': 'Westminster',
+}
+
+# names of the boroughs in the sources (PAS surveys, PAS dashboard, neighbourhood boundaries) that differ from the canonical names
+BOROUGH_ALIASES = {
+    'Richmond Upon Thames': 'Richmond upon Thames',
+    'Kingston Upon Thames': 'Kingston upon Thames',
+    'Kensington & Chelsea': 'Kensington and Chelsea',
+    'Hammersmith & Fulham': 'Hammersmith and Fulham',
+    'Barking & Dagenham': 'Barking and Dagenham',
+    'City of Westminster': 'Westminster',
+}
+
 questions_dict = {
     # 21 - 19 questions
     'Q13': ['To what extent are you worried about… Crime in this area? If necessary: By your area I mean 15 minutes walk from your home.', 'worries about crime near citizens'],
@@ -124,3 +215,107 @@ weights = {
 }
 
 weighted_questions = {'NNQ135A', 'NPQ135A', 'ReNQ147'}
+
+# PAS ward level survey file of every financial year
+PAS_WARD_LEVEL_FILES = {
+    "20-21": 'data/pas_data_ward_level/PAS_ward_level_FY_20_21.csv',
+    "19-20": 'data/pas_data_ward_level/PAS_ward_level_FY_19_20.csv',
+    "18-19": 'data/pas_data_ward_level/PAS_ward_level_FY_18_19.csv',
+    "17-18": 'data/pas_data_ward_level/PAS_ward_level_FY_17_18.csv',
+    "15-17": 'data/pas_data_ward_level/PAS_ward_level_FY_15_17.csv'
+}
+
+# the columns of every financial year that are named differently than in 20-21 (year: {column in the file: column in 20-21})
+PAS_COLUMN_ADAPTERS = {
+    "20-21": {},
+    "19-20": {'C2': 'Borough', 'NQ147r': 'ReNQ147'},
+    "18-19": {'C2': 'Borough', 'NQ147r': 'ReNQ147', 'PQ135AA': 'NPQ135A'},
+    "17-18": {'C2': 'Borough', 'NQ147r': 'ReNQ147', 'PQ135AA': 'NPQ135A'},
+    "15-17": {'C2': 'Borough', 'NQ147r': 'ReNQ147', 'PQ135AA': 'NPQ135A'}
+}
+
+#Define the questions and their corresponding statement and values (for the dashboard also)
+recommendation_questions = {
+    "Q13": {
+        "statement": "Q13: To what extent are you worried about crime in this area?",
+        "values": ["Very worried", "Fairly worried"]
+    },
+    "Q15": {
+        "statement": "Q15: To what extent are you worried about anti-social behaviour in this area?",
+        "values": ["Very worried", "Fairly worried"]
+    },
+    "Q60": {
+        "statement": "Q60: Taking everything into account, how good a job do you think the police IN YOUR AREA are doing?",
+        "values": ["Poor", "Very poor"]
+    },
+    "Q62A": {
+        "statement": "Q62A: To what extent do you agree with these statements about the police in your area?\
+        By 'your area' I mean within 15 minutes' walk from your home. \
+        They can be relied on to be there when you need them",
+        "values": ["Tend to disagree", "Strongly disagree"]
+    },
+    "Q62B": {
+        "statement": "Q62B: To what extent do you agree with these statements about the police in your area?\
+        By 'your area' I mean within 15 minutes' walk from your home. \
+        They would treat you with respect if you had contact with them for any reason.",
+        "values": ["Tend to disagree", "Strongly disagree"]
+    },
+    "Q62C": {
+        "statement": "Q62C: To what extent do you agree with these statements about the police in your area?\
+        By 'your area' I mean within 15 minutes' walk from your home. \
+        The police in your area treat everyone fairly regardless of who they are.",
+        "values": ["Tend to disagree", "Strongly disagree"]
+    },
+    "Q62D": {
+        "statement": "Q62D: To what extent do you agree with these statements about the police in this area?\
+        By 'this area' I mean within 15 minutes' walk from here. They can be relied on to deal with minor crimes",
+        "values": ["Tend to disagree", "Strongly disagree"]
+    },
+    "Q62E": {
+        "statement": "Q62E: To what extent do you agree with these statements about the police in this area?\
+        By 'this area' I mean within 15 minutes' walk from here. They understand the issues that affect this community",
+        "values": ["Tend to disagree", "Strongly disagree"]
+    },
+    "Q62TG": {
+        "statement": "Q62TG: To what extent do you agree with these statements about the police in your area? \
+        By 'your area' I mean within 15 minutes' walk from your home. \
+        The police in your area listen to the concerns of local people.",
+        "values": ["Tend to disagree","Strongly disagree"]
+    },
+    "A121": {
+        "statement": "A121: How confident are you that the Police in your area use their stop and search powers fairly?",
+        "values": ["Not very confident", "Not at all confident"]
+    }, 
+    "Q62F": {
+        "statement": "Q62F: To what extent do you agree with these statements about the police in your area?\
+        By 'your area' I mean within 15 minutes' walk from your home.\
+        They are dealing with the things that matter to people in this community",
+        "values": ["Tend to disagree","Strongly disagree"]
+    },
+    "Q62H": {
+        "statement": "Q62H: To what extent do you agree with these statements about the police in this area?\
+        By 'this area' I mean within 15 minutes' walk from here. The police in this area are helpful",
+        "values": ["Tend to disagree","Strongly disagree"]
+    },
+    "Q62TI": {
+        "statement": "Q62TI: To what extent do you agree with these statements about the police in this area?\
+        By 'this area' I mean within 15 minutes' walk from here. The police in this area are friendly and approachable",
+        "values": ["Tend to disagree","Strongly disagree"]
+    },
+    "Q62TJ": {
+        "statement": "Q62TJ: To what extent do you agree with these statements about the police in this area?\
+        By 'this area' I mean within 15 minutes' walk from here. The police in this area are easy to contact",
+        "values": ["Tend to disagree", "strongly disagree"]
+    },
+    "NQ135BD": {
+        "statement": "NQ135BD: To what extent do you agree or disagree with the following statements:\
+        The Metropolitan Police Service is an organisation that I can trust",
+        "values": ["Tend to disagree", "strongly disagree"]
+    },
+    "NQ135BH": {
+        "statement": "NQ135BH: To what extent do you agree or disagree that\
+        the police in your local area are sufficiently held accountable for their actions?",
+        "values": ["Tend to disagree", "strongly disagree"]
+    }
+}
+
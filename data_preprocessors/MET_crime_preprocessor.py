@@ -3,36 +3,35 @@
 import os
 import sys
 
-import pandas as pd
+from concurrent.futures import ThreadPoolExecutor
+
+# modifying the root path for imports
+current = os.path.dirname(os.path.realpath(__file__))
+parent = os.path.dirname(current)
+sys.path.append(parent) 
+
+from functions.store_func import manifest_files, write_met_crime_month, MET_CRIME_STORE
 
 data_dir = 'data/met_data'
 
+# every month is converted on its own, this bounds the memory to a few months at the same time
+max_workers = min(4, os.cpu_count() or 1)
+
+all_files, n_rows = [], 0
+
 # Check if the directory exists
 if not os.path.exists(data_dir):
     print(f"Data directory '{data_dir}' does not exist.")
 else:
-    all_files = []
-    for root, dirs, files in os.walk(data_dir):
-        for file in files:
-            if file.endswith('-metropolitan-street.csv'):
-                all_files.append(os.path.join(root, file))
+    # one file per month, months present in several archives are listed once (see the manifest written by DATALOADER_stage_1)
+    all_files = manifest_files(data_dir, suffix='-metropolitan-street.csv')
 
     # Check if there are any files to read
     if not all_files:
         print(f"No CSV files found in the directory '{data_dir}'.")
     else:
-        df_list = [pd.read_csv(file) for file in all_files]
-
-        # Check if there are any DataFrames to concatenate
-        if not df_list:
-            print("No dataframes to concatenate.")
-        else:
-            # Combine all dataframes into one
-            df_all_years = pd.concat(df_list, ignore_index=True)
-
-try:
-    df_all_years.to_pickle('data/met_data/met_crime_data.pkl')
-except:
-    print("No Data Were Saved")
+        # pyarrow parses and writes without holding the GIL, so threads convert the months in parallel
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            n_rows = sum(pool.map(lambda file: write_met_crime_month(file, MET_CRIME_STORE), all_files))
 
-print(f"Combined {len(all_files)} files into one DataFrame with {len(df_all_years)}")
\ No newline at end of file
+print(f"Combined {len(all_files)} files into the crime store with {n_rows} rows")
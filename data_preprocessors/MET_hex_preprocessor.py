@@ -0,0 +1,66 @@
+# imports
+
+import os
+import sys
+
+import pandas as pd
+import pyarrow.dataset as ds
+
+from concurrent.futures import ThreadPoolExecutor
+
+# modifying the root path for imports
+current = os.path.dirname(os.path.realpath(__file__))
+parent = os.path.dirname(current)
+sys.path.append(parent)
+
+from config import HEX_RESOLUTIONS
+from functions.geo_func import hex_cells
+from functions.store_func import MET_CRIME_STORE, MET_CRIME_HEX_TABLE, open_met_crime_store, write_table
+
+
+# every month is counted on its own, this bounds the memory to a few months at the same time
+max_workers = min(4, os.cpu_count() or 1)
+
+
+def count_month(fragment: ds.Fragment) -> pd.DataFrame:
+    """
+    Counts the street crimes of one partition (month) of the crime store per hexagon of every resolution in HEX_RESOLUTIONS and crime type.
+
+    Returns
+    -
+    A long DataFrame with the columns Resolution, Cell, Month, Crime type and Count, crimes without coordinates are left out.
+    """
+    month = ds.get_partition_keys(fragment.partition_expression)['Month']
+    crimes = fragment.to_table(columns=['Latitude', 'Longitude', 'Crime type']).to_pandas()
+    crimes = crimes.dropna(subset=['Latitude', 'Longitude'])
+
+    counts = []
+    for resolution in HEX_RESOLUTIONS:
+        cells = pd.Series(hex_cells(crimes['Latitude'].to_numpy(), crimes['Longitude'].to_numpy(), resolution), index=crimes.index, name='Cell')
+        count = crimes.groupby([cells, crimes['Crime type']], observed=True).size().reset_index(name='Count')
+        count.insert(0, 'Resolution', resolution)
+        counts.append(count)
+
+    counts = pd.concat(counts, ignore_index=True)
+    counts.insert(2, 'Month', month)
+    counts['Crime type'] = counts['Crime type'].astype(str)
+    return counts.astype({'Resolution': 'int8', 'Count': 'int32'})
+
+
+### LOADING AND PREPROCESSING ###
+
+if __name__ == '__main__':
+    # the crime store is written by MET_crime_preprocessor (run `python build.py met_crime_hex` to build both)
+    if not os.path.exists(MET_CRIME_STORE):
+        sys.exit(f"MET crime store not found: {MET_CRIME_STORE}")
+
+    fragments = list(open_met_crime_store(MET_CRIME_STORE).get_fragments())
+
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        results_df = pd.concat(pool.map(count_month, fragments), ignore_index=True)
+
+    # sorted by resolution and month, such that reading one resolution or month skips most of the file
+    results_df = results_df.sort_values(by=['Resolution', 'Month', 'Cell', 'Crime type'], ignore_index=True)
+    write_table(results_df, MET_CRIME_HEX_TABLE)
+
+    print(f"Counted the crimes of {len(fragments)} months in {len(results_df)} hexagon cells")
@@ -4,6 +4,7 @@ import sys
 
 import pandas as pd
 from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor
 
 # modifying the root path for imports
 current = os.path.dirname(os.path.realpath(__file__))
@@ -11,12 +12,23 @@ parent = os.path.dirname(current)
 sys.path.append(parent) 
 
 # config imports 
-from config import questions_dict, weighted_questions, weights
+from config import questions_dict, weighted_questions, weights, recommendation_questions, PAS_WARD_LEVEL_FILES, PAS_COLUMN_ADAPTERS
+from functions.store_func import PAS_WARD_LEVEL_STORE, write_partition
+from functions.borough_func import to_boroughs
 
 
 
 ### FUNCTIONS ###
 
+# columns of the output with the share of every ethnic group among the respondents
+ethnic_columns = {
+    'White British': 'White_British_Proportion',
+    'White Other': 'White_Other_Proportion',
+    'Black': 'Black_Proportion',
+    'Asian': 'Asian_Proportion',
+    'Mixed': 'Mixed_Proportion',
+}
+
 # Function to extract the month and year
 def convert_date_format(date_str):
     # Split the string by parentheses and extract the part containing the month and year
@@ -25,82 +37,115 @@ def convert_date_format(date_str):
     return datetime.strptime(month_year_str, '%b %Y').strftime('%Y-%m')
 
 
+# questions which are counted for the store (the ethnicity itself is the ethnic group of every count)
+counted_questions = [question for question in dict.fromkeys(list(questions_dict.keys()) + list(recommendation_questions.keys())) if question != 'ReNQ147']
+
+# questions which are aggregated into pre_final.csv
+aggregated_questions = [question for question in questions_dict.keys() if question not in weighted_questions]
+
+
+def count_answers(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Melts the survey into long form and counts the answers to every question per borough, month and ethnic group.
+    The columns of `df` must already be named as in 20-21 (see PAS_COLUMN_ADAPTERS in config).
+
+    Returns
+    -
+    A DataFrame with the columns Borough, Date, Ethnicity, Measure, Answer and Count,
+    unanswered questions are counted with a missing Answer such that every respondent is counted for every question.
+    """
+    questions = [question for question in counted_questions if question in df.columns]
+
+    df = df.rename(columns={'MONTH': 'Date', 'ReNQ147': 'Ethnicity'})
+    df_long = df[['Borough', 'Date', 'Ethnicity'] + questions].melt(id_vars=['Borough', 'Date', 'Ethnicity'], var_name='Measure', value_name='Answer')
+
+    return df_long.groupby(['Borough', 'Date', 'Ethnicity', 'Measure', 'Answer'], dropna=False).size().rename('Count').reset_index()
+
+
+def preprocess_year(year: str) -> pd.DataFrame:
+    """
+    Counts the answers of the survey of one financial year and writes them to its partition of the store.
+    Runs in a worker process, one per year.
+
+    Returns
+    -
+    The counts of the questions that are aggregated into pre_final.csv.
+    """
+    csv_file_path = PAS_WARD_LEVEL_FILES[year]
+    adapter = PAS_COLUMN_ADAPTERS[year]
+
+    # Read the CSV file, only the columns we count, everything as text such that every year has the same types
+    needed_columns = {'Borough', 'MONTH', 'ReNQ147'} | set(counted_questions)
+    df = pd.read_csv(csv_file_path, dtype=str, usecols=lambda column: adapter.get(column, column) in needed_columns)
+    df = df.rename(columns=adapter)
+
+    # Apply the function to the MONTH column, once per distinct value
+    df['MONTH'] = df['MONTH'].map({month: convert_date_format(month) for month in df['MONTH'].dropna().unique()})
+
+    # the canonical borough names of the gazetteer (see BOROUGHS in config), stored as a categorical
+    counts = count_answers(df)
+    counts['Borough'] = to_boroughs(counts['Borough'])
+    write_partition(counts, PAS_WARD_LEVEL_STORE, 'FY', year)
+
+    return counts[counts['Measure'].isin(aggregated_questions)]
+
+
+def aggregate_counts(counts: pd.DataFrame) -> pd.DataFrame:
+    """
+    Computes the weighted proportion of every question and the ethnic shares of the respondents per borough and month.
+
+    The weighted proportion is the mean weight (see `weights` in config) of the answers that have a weight,
+    the ethnic shares are taken over all respondents of the borough and month.
+    """
+    keys = ['Borough', 'Date', 'Measure']
+
+    answer_weights = counts['Answer'].map(weights)
+    counts = counts.assign(Scored=counts['Count'].where(answer_weights.notna(), 0),
+                           Weighted=(counts['Count'] * answer_weights).fillna(0))
+
+    results_df = counts.groupby(keys, observed=True)[['Count', 'Scored', 'Weighted']].sum()
+    results_df['Total Proportion'] = results_df['Weighted'] / results_df['Scored']
+
+    # one pivot gives the number of respondents of every ethnic group
+    ethnic_counts = counts.pivot_table(index=keys, columns='Ethnicity', values='Count', aggfunc='sum', fill_value=0, observed=True)
+    for group, column in ethnic_columns.items():
+        if group in ethnic_counts.columns:
+            results_df[column] = ethnic_counts[group].reindex(results_df.index, fill_value=0) / results_df['Count']
+        else:
+            results_df[column] = 0.0
+    results_df['Other_Proportion'] = 1 - results_df['White_British_Proportion'] - results_df['White_Other_Proportion'] - results_df['Black_Proportion'] - results_df['Asian_Proportion']  # Assuming there are only 'White' and 'Black' ethnicities
+
+    results_df = results_df.reset_index()
+
+    # same order as the questions in config
+    order = {question: i for i, question in enumerate(questions_dict.keys())}
+    # the boroughs alphabetically, not in the order of their ONS codes (the categories of the borough)
+    sort_keys = {'Measure': lambda column: column.map(order), 'Borough': lambda column: column.astype(str)}
+    results_df = results_df.sort_values(by=['Measure', 'Borough', 'Date'], key=lambda column: sort_keys.get(column.name, lambda c: c)(column), ignore_index=True)
+
+    return results_df[['Date', 'Borough', 'Measure', 'Total Proportion', 'White_British_Proportion', 'White_Other_Proportion', 'Black_Proportion', 'Asian_Proportion', 'Mixed_Proportion', 'Other_Proportion']]
+
+
 
 ### LOADING AND PREPROCESSING ###
 
-# Define the path to the CSV file
-csv_file_path = r'data/PAS_data_ward_level/PAS_ward_level_FY_20_21.csv'
-
-# Define the column name for borough
-borough_column = 'Borough' if csv_file_path[-9:-4] == '20_21' else 'BOROUGHNEIGHBOURHOODCODED'
-
-# Read the CSV file
-df = pd.read_csv(csv_file_path)
-
-# Apply the function to the MONTH column
-df['MONTH'] = df['MONTH'].apply(convert_date_format)
-
-# Group the DataFrame by the "Borough" column
-grouped_df = df.groupby([borough_column, "MONTH"])
-
-    
-# Create a new DataFrame to store the results
-results_df = pd.DataFrame(columns=['Date', 'Borough', 'Measure', 'Total Proportion', 'White_British_Proportion', 'White_Other_Proportion', 'Black_Proportion', 'Asian_Proportion', 'Mixed_Proportion', 'Other_Proportion'])
-
-# Iterate over each question and borough to calculate proportions
-for question in questions_dict.keys():
-    for (borough, month), group_df in grouped_df:
-        date = month
-        measure = question
-        borough = borough
-
-        try:
-            # Calculate the total proportion
-            if question not in weighted_questions:
-                value_counts = group_df[question].value_counts()
-                summ = value_counts.sum()
-
-                for ans in value_counts.keys():
-                    try:
-                        value_counts[ans] = value_counts[ans] * weights.get(ans)        
-                    except:
-                        print(value_counts)
-                        break
-                total_proportion = value_counts.sum()/ summ
-            else:
-                continue
-
-            # Extract the ethnic group proportions
-            white_british_proportion = group_df[group_df['ReNQ147'] == 'White British'].shape[0] / group_df.shape[0]
-            black_proportion = group_df[group_df['ReNQ147'] == 'Black'].shape[0] / group_df.shape[0]
-            asian_proportion = group_df[group_df['ReNQ147'] == 'Asian'].shape[0] / group_df.shape[0]
-            white_other_proportion = group_df[group_df['ReNQ147'] == 'White Other'].shape[0] / group_df.shape[0]
-            mixed_proportion = group_df[group_df['ReNQ147'] == 'Mixed'].shape[0] / group_df.shape[0]
-            other_ethnicity_proportion = 1 - white_british_proportion - white_other_proportion - black_proportion - asian_proportion  # Assuming there are only 'White' and 'Black' ethnicities
-            
-            # Append the results to the DataFrame
-            results_df = results_df.append({
-                'Date': date,
-                'Borough': borough,
-                'Measure': measure,
-                'Total Proportion': total_proportion,
-                'White_British_Proportion': white_british_proportion,
-                'White_Other_Proportion': white_other_proportion,
-                'Black_Proportion': black_proportion,
-                'Asian_Proportion': asian_proportion,
-                'Mixed_Proportion': mixed_proportion,
-                'Other_Proportion': other_ethnicity_proportion
-            }, ignore_index=True)
-        except KeyError as e:
-            print(f"given question ({question}) didn't occur in {csv_file_path[-9:-4]}")
-         
- 
-# renaming values
-results_df.loc[results_df['Borough'] == 'Richmond Upon Thames', 'Borough'] = 'Richmond upon Thames'
-results_df.loc[results_df['Borough'] == 'Kensington & Chelsea', 'Borough'] = 'Kensington and Chelsea'
-results_df.loc[results_df['Borough'] == 'Hammersmith & Fulham', 'Borough'] = 'Hammersmith and Fulham'
-results_df.loc[results_df['Borough'] == 'Barking & Dagenham', 'Borough'] = 'Barking and Dagenham'
-results_df.loc[results_df['Borough'] == 'Westminster', 'Borough' ] = 'City of Westminster'
-
-# Print the resulting DataFrame
-results_df.to_csv('data/pas_data_ward_level/pre_final.csv')
+if __name__ == '__main__':
+    years = [year for year, csv_file_path in PAS_WARD_LEVEL_FILES.items() if os.path.exists(csv_file_path)]
+    for year in PAS_WARD_LEVEL_FILES.keys() - set(years):
+        print(f"PAS ward level file of {year} not found: {PAS_WARD_LEVEL_FILES[year]}")
+
+    # every financial year is read and counted in its own worker
+    with ProcessPoolExecutor(max_workers=max(1, min(len(years), os.cpu_count() or 1))) as pool:
+        year_counts = dict(zip(years, pool.map(preprocess_year, years)))
+    counts = pd.concat(year_counts.values(), ignore_index=True)
+
+    # the questions that were not asked in a year, summarised in one line
+    missing = {year: len(set(aggregated_questions) - set(year_counts[year]['Measure'].unique())) for year in years}
+    if any(missing.values()):
+        print("Questions that didn't occur: " + ', '.join(f'{n} in {year}' for year, n in missing.items() if n))
+
+    # aggregate the counts of all years in one pass
+    results_df = aggregate_counts(counts)
+
+    # Print the resulting DataFrame
+    results_df.to_csv('data/pas_data_ward_level/pre_final.csv')
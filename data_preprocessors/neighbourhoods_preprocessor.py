@@ -0,0 +1,38 @@
+# imports
+
+import os
+import sys
+
+import geopandas as gpd
+
+# modifying the root path for imports
+current = os.path.dirname(os.path.realpath(__file__))
+parent = os.path.dirname(current)
+sys.path.append(parent)
+
+from functions.borough_func import to_boroughs
+from functions.geo_func import NEIGHBOURHOODS_GEOJSON, NEIGHBOURHOODS_LOD, BOROUGHS_LOD, LOD_TOLERANCES, build_levels_of_detail
+
+
+def write_geoparquet(gdf: gpd.GeoDataFrame, path: str):
+    """Writes `gdf` as GeoParquet, replacing the previous file atomically."""
+    gdf.to_parquet(path + '.tmp')
+    os.replace(path + '.tmp', path)
+
+
+### LOADING AND PREPROCESSING ###
+
+if __name__ == '__main__':
+    if not os.path.exists(NEIGHBOURHOODS_GEOJSON):
+        sys.exit(f"Neighbourhood boundaries not found: {NEIGHBOURHOODS_GEOJSON}")
+
+    neighbourhoods = gpd.read_file(NEIGHBOURHOODS_GEOJSON)
+    neighbourhoods['borough'] = to_boroughs(neighbourhoods['borough'])
+
+    # the maps colour the neighbourhoods by borough, they share their simplified borders at every level of detail
+    neighbourhood_levels, borough_levels = build_levels_of_detail(neighbourhoods, LOD_TOLERANCES)
+
+    write_geoparquet(neighbourhood_levels, NEIGHBOURHOODS_LOD)
+    write_geoparquet(borough_levels, BOROUGHS_LOD)
+
+    print(f"Simplified {len(neighbourhoods)} neighbourhoods at {len(LOD_TOLERANCES)} levels of detail")
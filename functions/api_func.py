@@ -1,10 +1,133 @@
 import os
 import json
+import time
+import asyncio
+import re
+import hashlib
 import requests
+import itertools
+import threading
 
-from typing import List
+import shapely
+import pandas as pd
+
+from typing import Iterable, AsyncIterator
+from urllib.parse import parse_qsl
 from datetime import datetime
+from tqdm import tqdm
 from ipyleaflet import Map, Marker
+from shapely.geometry import Polygon, MultiPolygon
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from config import API_BURST, HTTP_CACHE_TTL, OUTCOME_REFRESH_DAYS, OPEN_OUTCOME_CATEGORIES
+from functions.http_func import get_json, post_json, RETRY_STATUS
+from functions.table_func import response_parser, concat_tables, drop_duplicate_crimes
+from functions.app_func import get_squares_from_rect
+from functions.store_func import OUTCOME_STORE, open_outcome_store, read_outcomes, write_outcomes, METADATA_STORE, open_metadata_store, read_metadata, write_metadata
+
+
+# the API refuses GET requests longer than this, larger custom areas are sent with POST
+MAX_URL_LENGTH = 4094
+
+# tolerance (in degrees, about 10 meters) of the Douglas-Peucker simplification of custom areas that are too long for a GET request
+POLY_SIMPLIFY_TOLERANCE = 0.0001
+
+
+def encode_poly(poly, tolerance: float = None) -> str:
+    """
+    Encodes a custom area as the `poly` parameter of the API: lat/lng pairs separated by colons, "lat,lng:lat,lng:lat,lng".
+
+    Parameters
+    -
+    poly - list of (lat, lng) pairs with any number of vertices, or a shapely Polygon in lng/lat order (as in GeoJSON)\n
+    tolerance - simplify the boundary with the Douglas-Peucker algorithm first, vertices that deviate less than
+        `tolerance` degrees from the simplified boundary are dropped (optional)
+
+    Returns
+    -
+    The encoded polygon, coordinates are rounded to 6 decimals (about 0.1 meter).
+
+    Examples
+    -
+    ```python
+    encode_poly([(52.268, 0.543), (52.794, 0.238), (52.130, 0.478)])  # '52.268,0.543:52.794,0.238:52.13,0.478'
+    ```
+    """
+    polygon = poly if isinstance(poly, Polygon) else Polygon([(lng, lat) for lat, lng in poly])
+    if tolerance:
+        simplified = polygon.simplify(tolerance, preserve_topology=True)
+        if isinstance(simplified, Polygon) and not simplified.is_empty:
+            polygon = simplified
+
+    # the API closes the polygon itself
+    coords = list(polygon.exterior.coords)[:-1]
+    return ':'.join(f"{round(lat, 6)},{round(lng, 6)}" for lng, lat in coords)
+
+
+def get_area_json(url: str, poly, **kwargs):
+    """
+    Requests `url` for the custom area `poly` (see `encode_poly`) with all its vertices.
+
+    When the url gets longer than MAX_URL_LENGTH the boundary is simplified (POLY_SIMPLIFY_TOLERANCE),
+    and when it is still too long the parameters are sent in the body of a POST request, so any area is one request.
+    """
+    encoded = encode_poly(poly)
+    if len(url) + len('&poly=') + len(encoded) > MAX_URL_LENGTH:
+        encoded = encode_poly(poly, tolerance=POLY_SIMPLIFY_TOLERANCE)
+
+    if len(url) + len('&poly=') + len(encoded) <= MAX_URL_LENGTH:
+        return get_json(f"{url}&poly={encoded}", **kwargs)
+
+    base_url, query = url.split('?', 1)
+    return post_json(base_url, {**dict(parse_qsl(query)), 'poly': encoded}, **kwargs)
+
+
+# the date of the last update of the API and until when it is used (time.monotonic), shared by all metadata lookups of the process
+_last_updated = {'expires': 0, 'date': None}
+_last_updated_lock = threading.Lock()
+
+# seconds after which an API that could not be reached is asked again
+LAST_UPDATED_RETRY = 60
+
+
+def last_updated_date():
+    """
+    The date of the last update of the API, requested at most once per HTTP_CACHE_TTL seconds.
+    None when the API can not be reached: the request is not tried again, such that the stored metadata is used at once,
+    and the API is only asked again after LAST_UPDATED_RETRY seconds.
+    """
+    with _last_updated_lock:
+        if time.monotonic() >= _last_updated['expires']:
+            try:
+                _last_updated['date'] = get_json('https://data.police.uk/api/crime-last-updated', max_retries=0, timeout=(5, 10))['date']
+                _last_updated['expires'] = time.monotonic() + HTTP_CACHE_TTL
+            except requests.RequestException:
+                _last_updated['date'] = None
+                _last_updated['expires'] = time.monotonic() + LAST_UPDATED_RETRY
+        return _last_updated['date']
+
+
+def get_metadata_json(url: str, store_path: str = METADATA_STORE):
+    """
+    Serves the reference data of the API (forces, neighbourhoods, teams, events, priorities) from the metadata catalogue.
+
+    A stored response is used as long as the API was not updated since it was fetched (`last_updated_date`),
+    otherwise it is requested again and stored. When the API can not be reached, any stored response is used.
+    """
+    last_updated = last_updated_date()
+
+    conn = open_metadata_store(store_path)
+    try:
+        body = read_metadata(conn, url, last_updated)
+        if body is None:
+            if last_updated is None:
+                raise requests.ConnectionError(f"{url} is not in the metadata catalogue and the API can not be reached")
+            # the catalogue replaces the http cache for reference data
+            body = get_json(url, ttl=0)
+            write_metadata(conn, url, body, last_updated)
+        return body
+    finally:
+        conn.close()
 
 
 def extract_forces(type: str = None) -> list:
@@ -40,13 +163,12 @@ def extract_forces(type: str = None) -> list:
     elif 'leicestershire/people' == type.lower():
         url = base_url + '/' + type.lower()
 
-    r = requests.get(url)
-    list_of_dict = json.loads(r.content)
+    list_of_dict = get_metadata_json(url)
     return list_of_dict
 
 
 
-def extract_street_level_crimes(lat: float = None, lng: float = None, date: str = None, poly = None, crime_type: str = None) -> list:
+def extract_street_level_crimes(lat: float = None, lng: float = None, date: str = None, poly = None, crime_type: str = None, retry_on: tuple = RETRY_STATUS, output: str = 'json') -> list:
     """
     Extracts the street-level crimes data for a specific location or custom area.
 
@@ -56,10 +178,12 @@ def extract_street_level_crimes(lat: float = None, lng: float = None, date: str
     lng - Longitude of the requested crime area (optional)\n
     date - Optional. "YYYY-MM" Limit results to a specific month. The latest month will be shown by default (optional)\n
     OR: \n
-    poly - Limit results to a specific area. The lat/lng pairs which define the boundary of the custom area (optional)\n
+    poly - Limit results to a specific area. The lat/lng pairs which define the boundary of the custom area (any number of vertices), or a shapely Polygon (optional)\n
 
     You can also specify the type of crime:\n
     crime_type - The type of crime. Options are: None, anti-social-behavior, burglary (optional)\n
+    retry_on - status codes after which the request is tried again (optional), see functions/http_func.py\n
+    output - "json" (list of dictionaries), "table" (flat pyarrow Table) or "pandas" (flat DataFrame), see functions/table_func.py (optional)
 
     Returns
     -
@@ -104,14 +228,7 @@ def extract_street_level_crimes(lat: float = None, lng: float = None, date: str
         if (lat and lng )!= None:
             url = base_url + f"lat={lat}&lng={lng}&date={current_year}-{current_month}"
         elif poly != None:
-            result = []
-            for pair in poly:
-                lat, lon = pair
-                result.append(f"{lat}:{lon}")
-
-            poly_req = 'poly=' + ",".join(result)
-
-            url = base_url + f"{poly_req}&date={current_year}-{current_month}"
+            url = base_url + f"date={current_year}-{current_month}"
 
         else:
             raise ValueError(f'Specify the lat/lng, you passed {lat, lng} or poly {poly}')
@@ -120,29 +237,23 @@ def extract_street_level_crimes(lat: float = None, lng: float = None, date: str
         if lat and lng != None:
             url = base_url + f"lat={lat}&lng={lng}&date={date}"
         elif poly != None:
-            result = []
-            for pair in poly:
-                lat, lon = pair
-                result.append(f"{lat}:{lon}")
-
-            poly_req = 'poly=' + ",".join(result)
-            
-            url = base_url + f"{poly_req}&date={date}"
+            url = base_url + f"date={date}"
 
         else:
             raise ValueError(f'Specify the lat/lang, you passed {lat, lng} or poly {poly}')
     else: 
         raise ValueError(f'Specify the date, you passed {date}')
-   
-    print(url)
-    r = requests.get(url)
-    list_of_dict = json.loads(r.content)
-    
-    return list_of_dict
+
+    # tables are parsed from the body of the response, not from decoded dictionaries
+    parse = response_parser('crime', output)
+    if (lat and lng) == None and poly != None:
+        return get_area_json(url, poly, retry_on=retry_on, parse=parse)
+    else:
+        return get_json(url, retry_on=retry_on, parse=parse)
 
 
 
-def extract_street_level_outcomes(location_id: int = None, lat: float = None, lng: float = None, date: str = None, poly: list = None) -> list:
+def extract_street_level_outcomes(location_id: int = None, lat: float = None, lng: float = None, date: str = None, poly: list = None, output: str = 'json') -> list:
     """
     Extracts the street-level outcomes for a specified location or area.
 
@@ -152,11 +263,12 @@ def extract_street_level_outcomes(location_id: int = None, lat: float = None, ln
     lng - Longitude of the requested crime area\n
     date - Optional. "YYYY-MM" Limit results to a specific month. \n
         The latest month will be shown by default
-    poly - The lat/lng pairs which define the boundary of the custom area. \n
-        The poly parameter is formatted in lat/lng pairs, separated by 
+    poly - The lat/lng pairs which define the boundary of the custom area (any number of vertices), or a shapely Polygon. \n
+        The poly parameter is encoded by `encode_poly` as lat/lng pairs, separated by 
         colons: [lat],[lng]:[lat],[lng]:[lat],[lng]
     location_id - Crimes and outcomes are mapped to specific locations on the map. \n
-        Valid IDs are returned by other methods which return location information.
+        Valid IDs are returned by other methods which return location information.\n
+    output - "json" (list of dictionaries), "table" (flat pyarrow Table) or "pandas" (flat DataFrame), see functions/table_func.py (optional)
 
     Returns
     -
@@ -199,7 +311,7 @@ def extract_street_level_outcomes(location_id: int = None, lat: float = None, ln
         if lat and lng != None:
             url = base_url + f"date={current_year}-{current_month}&lat={lat}&lng={lng}"
         elif poly != None:
-            url = base_url + f"date={current_year}-{current_month}&poly={poly[0][0]}:{poly[0][1]},{poly[1][0]}:{poly[1][1]},{poly[2][0]},{poly[2][1]}"
+            url = base_url + f"date={current_year}-{current_month}"
         elif location_id != None:
             url = base_url + f"date={current_year}-{current_month}&location_id={location_id}"
         else:
@@ -209,7 +321,7 @@ def extract_street_level_outcomes(location_id: int = None, lat: float = None, ln
         if lat and lng != None:
             url = base_url + f"date={date}&lat={lat}&lng={lng}"
         elif poly != None:
-            url = base_url + f"date={date}&poly={poly[0][0]}:{poly[0][1]},{poly[1][0]}:{poly[1][1]},{poly[2][0]}:{poly[2][1]}"
+            url = base_url + f"date={date}"
         elif location_id != None:
             url = base_url + f"date={date}&location_id={location_id}"
         else:
@@ -217,17 +329,17 @@ def extract_street_level_outcomes(location_id: int = None, lat: float = None, ln
         
     else: 
         raise ValueError(f'Specify the date, you passed {date}')
-   
-   
-    r = requests.get(url)
-    list_of_dict = json.loads(r.content)
-    
-    return list_of_dict
+
+    parse = response_parser('outcome', output)
+    if not (lat and lng != None) and poly != None:
+        return get_area_json(url, poly, parse=parse)
+    else:
+        return get_json(url, parse=parse)
 
 
 
 
-def extract_crimes_at_location(lat: float = None, lng: float = None, date: str = None, location_id: int = None) -> list:
+def extract_crimes_at_location(lat: float = None, lng: float = None, date: str = None, location_id: int = None, output: str = 'json') -> list:
     """
     Extracts the crime data for a specific location based on latitude and longitude.
 
@@ -237,6 +349,7 @@ def extract_crimes_at_location(lat: float = None, lng: float = None, date: str =
     lng (float): Longitude of the requested crime area.\n
     date (str): Optional. "YYYY-MM" Limit results to a specific month. The latest month will be shown by default.\n
     location_id (int): Crimes and outcomes are mapped to specific locations on the map. Valid IDs are returned by other methods which return location information.\n
+    output (str): "json" (list of dictionaries), "table" (flat pyarrow Table) or "pandas" (flat DataFrame), see functions/table_func.py.
 
     Returns
     -
@@ -275,15 +388,12 @@ def extract_crimes_at_location(lat: float = None, lng: float = None, date: str =
         raise ValueError(f'Specify the date, you passed {date}')
    
    
-    r = requests.get(url)
-    list_of_dict = json.loads(r.content)
-    
-    return list_of_dict
+    return get_json(url, parse=response_parser('crime', output))
 
 
 
 
-def extract_crimes_no_location(category: str = 'all-crime', force: str = 'leicestershire', date: str = None) -> list:
+def extract_crimes_no_location(category: str = 'all-crime', force: str = 'leicestershire', date: str = None, output: str = 'json') -> list:
     """
     Extracts crimes data without location information.
 
@@ -293,6 +403,7 @@ def extract_crimes_no_location(category: str = 'all-crime', force: str = 'leices
     date (str): Optional. "YYYY-MM" Limit results to a specific month. \n
         The latest month will be shown by default
     force (str): The name of the police force. If not specified, data for all forces will be returned.\n
+    output (str): "json" (list of dictionaries), "table" (flat pyarrow Table) or "pandas" (flat DataFrame), see functions/table_func.py.
 
     Returns
     -
@@ -337,10 +448,7 @@ def extract_crimes_no_location(category: str = 'all-crime', force: str = 'leices
         raise ValueError(f'Specify the date, you passed: date={date}')
    
    
-    r = requests.get(url)
-    list_of_dict = json.loads(r.content)
-    
-    return list_of_dict
+    return get_json(url, parse=response_parser('crime', output))
 
 
 
@@ -390,8 +498,7 @@ def extract_crimes_categories_at_date(date: str = None) -> list:
         raise ValueError(f'Specify the date, you passed {date}')
    
    
-    r = requests.get(url)
-    list_of_dict = json.loads(r.content)
+    list_of_dict = get_json(url)
     
     return list_of_dict
 
@@ -413,22 +520,22 @@ def extract_last_updated():
 
     url = 'https://data.police.uk/api/crime-last-updated'
 
-    r = requests.get(url)
-    list_of_dict = json.loads(r.content)
+    list_of_dict = get_json(url)
 
     return list_of_dict
 
 
 
 
-def extract_outcome_for_specific_crime(crime_id: str = None) -> list:
+def extract_outcome_for_specific_crime(crime_id: str = None, ttl='auto') -> list:
     """
     Returns the outcomes (case history) for the specified crime.
     Note: Outcomes are not available for the Police Service of Northern Ireland.
 
     Parameters:
     -
-    crime_id (str): 64-character identifier of the crime for which to retrieve outcomes.
+    crime_id (str): 64-character identifier of the crime for which to retrieve outcomes.\n
+    ttl: Optional. How long the response is kept in the http cache, see functions/http_func.py.
 
     Returns:
     -
@@ -454,8 +561,7 @@ def extract_outcome_for_specific_crime(crime_id: str = None) -> list:
     elif crime_id == None:
         raise ValueError(f"Specify the crime_id that you passed and make sure it's correct: crime_id={crime_id}")
     
-    r = requests.get(url)
-    list_of_dict = json.loads(r.content)
+    list_of_dict = get_json(url, ttl=ttl)
 
     return list_of_dict
 
@@ -493,8 +599,7 @@ def extract_neighbourhoods_for_a_force(force: str = 'leicestershire') -> list:
     elif force == None:
         raise ValueError(f"Specify the force that you passed and make sure it's correct: force={force}")
 
-    r = requests.get(url)
-    list_of_dict = json.loads(r.content)
+    list_of_dict = get_metadata_json(url)
 
     return list_of_dict
 
@@ -535,8 +640,7 @@ def extract_specific_neighbourhoods_for_a_force(force: str = 'leicestershire', n
     else:
         raise ValueError(f"Specify the force and neighbourhood that you passed and make sure it's correct: force={force}, neighbourhood_id={neighbourhood_id}")
     
-    r = requests.get(url)
-    list_of_dict = json.loads(r.content)
+    list_of_dict = get_metadata_json(url)
 
     return list_of_dict
 
@@ -577,8 +681,7 @@ def extract_neighbourhood_boundary_for_a_force(force: str = 'leicestershire', ne
     else:
         raise ValueError(f"Specify the force and neighbourhood that you passed and make sure it's correct: force={force}, neighbourhood_id={neighbourhood_id}")
     
-    r = requests.get(url)
-    list_of_dict = json.loads(r.content)
+    list_of_dict = get_metadata_json(url)
 
     return list_of_dict
 
@@ -619,8 +722,7 @@ def extract_neighbourhood_team_for_a_force(force: str = 'leicestershire', neighb
     else:
         raise ValueError(f"Specify the force and neighbourhood that you passed and make sure it's correct: force={force}, neighbourhood_id={neighbourhood_id}")
     
-    r = requests.get(url)
-    list_of_dict = json.loads(r.content)
+    list_of_dict = get_metadata_json(url)
 
     return list_of_dict
 
@@ -661,8 +763,7 @@ def extract_neighbourhood_events_for_a_force(force: str = 'leicestershire', neig
     else:
         raise ValueError(f"Specify the force and neighbourhood that you passed and make sure it's correct: force={force}, neighbourhood_id={neighbourhood_id}")
     
-    r = requests.get(url)
-    list_of_dict = json.loads(r.content)
+    list_of_dict = get_metadata_json(url)
 
     return list_of_dict
 
@@ -702,8 +803,7 @@ def extract_neighbourhood_priorities_for_a_force(force: str = 'leicestershire',
     else:
         raise ValueError(f"Specify the force and neighbourhood that you passed and make sure it's correct: force={force}, neighbourhood_id={neighbourhood_id}")
     
-    r = requests.get(url)
-    list_of_dict = json.loads(r.content)
+    list_of_dict = get_metadata_json(url)
 
     return list_of_dict
 
@@ -734,6 +834,9 @@ def extract_neighbourhood_at_location(lat: float, lng: float) -> list:
     ```python
     location_data = extract_neighbourhood_at_location(lat=51.5074, lng=-0.1278)
     ```
+
+    To find the neighbourhoods of many points (e.g. all crimes of a month) use NeighbourhoodGeocoder in functions/geo_func.py,
+    which does the lookup locally instead of a request per point.
     """
 
     # Get current year
@@ -749,14 +852,13 @@ def extract_neighbourhood_at_location(lat: float, lng: float) -> list:
     else:
         raise ValueError(f'specify the lat and lng that you passed and make sure they are correct: lat/lng-{lat, lng}')
 
-    r = requests.get(url)
-    list_of_dict = json.loads(r.content)
+    list_of_dict = get_json(url)
 
     return list_of_dict
 
 
 
-def extract_stop_search(date: str = None, lng: float = None, lat: float = None, poly: list = None, location_id: str = None) -> list:
+def extract_stop_search(date: str = None, lng: float = None, lat: float = None, poly: list = None, location_id: str = None, output: str = 'json') -> list:
     """
     Extracts stop and search data for a specific location or custom area.
 
@@ -765,8 +867,9 @@ def extract_stop_search(date: str = None, lng: float = None, lat: float = None,
     lat - Latitude of the requested crime area (optional)\n
     lng - Longitude of the requested crime area (optional)\n
     date - Optional. "YYYY-MM" Limit results to a specific month. The latest month will be shown by default (optional)\n
-    poly - The lat/lng pairs which define the boundary of the custom area. The poly parameter is formatted in lat/lng pairs, separated by colons: [lat],[lng]:[lat],[lng]:[lat],[lng] (optional)\n
+    poly - The lat/lng pairs which define the boundary of the custom area (any number of vertices), or a shapely Polygon. The poly parameter is encoded by `encode_poly` as lat/lng pairs, separated by colons: [lat],[lng]:[lat],[lng]:[lat],[lng] (optional)\n
     location_id - The ID of the location to get stop and searches for (optional)\n
+    output - "json" (list of dictionaries), "table" (flat pyarrow Table) or "pandas" (flat DataFrame), see functions/table_func.py (optional)
 
     Returns:
     -
@@ -811,7 +914,7 @@ def extract_stop_search(date: str = None, lng: float = None, lat: float = None,
         if lat and lng != None:
             url = base_url + f"lat={lat}&lng={lng}&date={current_year}-{current_month}"
         elif poly != None:
-            url = base_url + f"poly={poly[0][0]}:{poly[0][1]},{poly[1][0]}:{poly[1][1]},{poly[2][0]}:{poly[2][1]}&date={current_year}-{current_month}"
+            url = base_url + f"date={current_year}-{current_month}"
         elif location_id!= None:
             url = base_url + f"location_id={location_id}&date={current_year}-{current_month}"
         else:
@@ -821,7 +924,7 @@ def extract_stop_search(date: str = None, lng: float = None, lat: float = None,
         if lat and lng != None:
             url = base_url + f"lat={lat}&lng={lng}&date={date}"
         elif poly != None:
-            url = base_url + f"poly={poly[0][0]}:{poly[0][1]},{poly[1][0]}:{poly[1][1]},{poly[2][0]}:{poly[2][1]}&date={date}"
+            url = base_url + f"date={date}"
         elif location_id!= None:
             url = base_url + f"location_id={location_id}&date={date}"
         else:
@@ -829,16 +932,16 @@ def extract_stop_search(date: str = None, lng: float = None, lat: float = None,
         
     else: 
         raise ValueError(f'Specify the date, you passed {date}')
-   
-   
-    r = requests.get(url)
-    list_of_dict = json.loads(r.content)
 
-    return list_of_dict
+    parse = response_parser('stop_search', output)
+    if not (lat and lng != None) and poly != None:
+        return get_area_json(url, poly, parse=parse)
+    else:
+        return get_json(url, parse=parse)
 
 
 
-def extract_stop_search_no_loc(date: str, force: str = None) -> list:
+def extract_stop_search_no_loc(date: str, force: str = None, output: str = 'json') -> list:
     """
     Extracts stop and search data for a specific police force without location.
 
@@ -849,6 +952,7 @@ def extract_stop_search_no_loc(date: str, force: str = None) -> list:
         the format "YYYY-MM".
     force (str): The name of the police force for which to retrieve data.
         If not specified, data for all forces will be returned.
+    output (str): "json" (list of dictionaries), "table" (flat pyarrow Table) or "pandas" (flat DataFrame), see functions/table_func.py.
 
     Returns:
     -
@@ -878,15 +982,12 @@ def extract_stop_search_no_loc(date: str, force: str = None) -> list:
     else:
         raise ValueError("Please specify a date and force")
 
-    r = requests.get(url)
-    list_of_dicts = json.loads(r.content)
-
-    return list_of_dicts
+    return get_json(url, parse=response_parser('stop_search', output))
 
 
 
 
-def extract_stop_search_force(date: str = None, force: str = 'avon-and-somerset') -> list:
+def extract_stop_search_force(date: str = None, force: str = 'avon-and-somerset', output: str = 'json') -> list:
     """
     Extracts stop and search data for a specific police force.
 
@@ -897,6 +998,7 @@ def extract_stop_search_force(date: str = None, force: str = 'avon-and-somerset'
         the format "YYYY-MM".
     force (str): The name of the police force for which to retrieve data.
         If not specified, data for all forces will be returned.
+    output (str): "json" (list of dictionaries), "table" (flat pyarrow Table) or "pandas" (flat DataFrame), see functions/table_func.py.
 
     Returns:
     -
@@ -923,11 +1025,413 @@ def extract_stop_search_force(date: str = None, force: str = 'avon-and-somerset'
     else:
         raise ValueError("Please specify a date and force")
 
-    r = requests.get(url)
-    list_of_dicts = json.loads(r.content)
+    return get_json(url, parse=response_parser('stop_search', output))
+
+
+
+async def _extract_many(extractor, queries: Iterable[dict], max_concurrency: int = API_BURST, return_exceptions: bool = False) -> AsyncIterator[tuple]:
+    """
+    Runs `extractor` for every query (keyword arguments) with at most `max_concurrency` requests in flight
+    and yields `(query, result)` as soon as a request finishes, so results arrive in completion order.
+
+    The requests go through the shared session of functions/http_func, so they stay under the rate limit of the API
+    and are served from the cache when possible. With `return_exceptions` a failed query yields its exception as result,
+    otherwise the first failure is raised and the remaining requests are cancelled.
+    """
+    loop = asyncio.get_running_loop()
+    queries = iter(queries)
+    running = set()
+
+    # shut down without waiting below, a failure or an early aclose must not block the event loop until the requests in flight finish
+    pool = ThreadPoolExecutor(max_workers=max_concurrency)
+
+    async def run(query: dict):
+        try:
+            return query, await loop.run_in_executor(pool, lambda: extractor(**query))
+        except Exception as e:
+            if not return_exceptions:
+                raise
+            return query, e
+
+    def fill():
+        # a task is created for the next query only when a request slot is free
+        for query in itertools.islice(queries, max_concurrency - len(running)):
+            running.add(asyncio.ensure_future(run(dict(query))))
+
+    try:
+        fill()
+        while running:
+            done, _ = await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                running.discard(task)
+                fill()
+                yield task.result()
+    finally:
+        for task in running:
+            task.cancel()
+        pool.shutdown(wait=False, cancel_futures=True)
+
+
+def _location_query(query) -> dict:
+    # (lat, lng, date), (poly, date) or a dictionary with the keyword arguments of the extractor
+    if isinstance(query, dict):
+        return query
+    if len(query) == 3:
+        lat, lng, date = query
+        return {'lat': lat, 'lng': lng, 'date': date}
+    poly, date = query
+    return {'poly': poly, 'date': date}
+
+
+def extract_street_level_crimes_many(queries: Iterable, crime_type: str = None, max_concurrency: int = API_BURST, return_exceptions: bool = False, output: str = 'json') -> AsyncIterator[tuple]:
+    """
+    Asynchronous counterpart of `extract_street_level_crimes` for many locations and months.
+
+    Parameters
+    -
+    queries - iterable of (lat, lng, date) or (poly, date) tuples, or dictionaries with the arguments of `extract_street_level_crimes`\n
+    crime_type - The type of crime, applied to every query (optional)\n
+    max_concurrency - maximum number of requests in flight (optional)\n
+    return_exceptions - yield the exception of a failed query instead of raising it (optional)\n
+    output - format of every result: "json", "table" or "pandas", see functions/table_func.py (optional)
+
+    Returns
+    -
+    An asynchronous iterator of (query, list of crimes) tuples, in the order in which the requests finish.
+
+    Examples
+    -
+    ```python
+    async def pull():
+        queries = [(51.5074, -0.1278, f'2023-{month:02d}') for month in range(1, 13)]
+        async for query, crimes in extract_street_level_crimes_many(queries):
+            print(query['date'], len(crimes))
+
+    asyncio.run(pull())
+    ```
+
+    A multi-month pull as one table, without building a dictionary per crime for the whole year:
+
+    ```python
+    async def pull_table():
+        return concat_tables([crimes async for query, crimes in extract_street_level_crimes_many(queries, output='table')])
+    ```
+    """
+    queries = ({**_location_query(query), 'crime_type': crime_type, 'output': output} for query in queries)
+    return _extract_many(extract_street_level_crimes, queries, max_concurrency, return_exceptions)
+
+
+def extract_stop_search_many(queries: Iterable, max_concurrency: int = API_BURST, return_exceptions: bool = False, output: str = 'json') -> AsyncIterator[tuple]:
+    """
+    Asynchronous counterpart of `extract_stop_search` for many locations and months.
+
+    Parameters
+    -
+    queries - iterable of (lat, lng, date) or (poly, date) tuples, or dictionaries with the arguments of `extract_stop_search` (e.g. location_id)\n
+    max_concurrency - maximum number of requests in flight (optional)\n
+    return_exceptions - yield the exception of a failed query instead of raising it (optional)\n
+    output - format of every result: "json", "table" or "pandas", see functions/table_func.py (optional)
+
+    Returns
+    -
+    An asynchronous iterator of (query, list of stop and searches) tuples, in the order in which the requests finish.
+    """
+    queries = ({**_location_query(query), 'output': output} for query in queries)
+    return _extract_many(extract_stop_search, queries, max_concurrency, return_exceptions)
+
+
+def extract_street_level_outcomes_many(queries: Iterable, max_concurrency: int = API_BURST, return_exceptions: bool = False, output: str = 'json') -> AsyncIterator[tuple]:
+    """
+    Asynchronous counterpart of `extract_street_level_outcomes` for many locations and months.
+
+    Parameters
+    -
+    queries - iterable of (lat, lng, date) or (poly, date) tuples, or dictionaries with the arguments of `extract_street_level_outcomes`\n
+    max_concurrency - maximum number of requests in flight (optional)\n
+    return_exceptions - yield the exception of a failed query instead of raising it (optional)\n
+    output - format of every result: "json", "table" or "pandas", see functions/table_func.py (optional)
+
+    Returns
+    -
+    An asynchronous iterator of (query, list of outcomes) tuples, in the order in which the requests finish.
+    """
+    queries = ({**_location_query(query), 'output': output} for query in queries)
+    return _extract_many(extract_street_level_outcomes, queries, max_concurrency, return_exceptions)
+
+
+def extract_outcomes_for_crimes_many(crime_ids: Iterable[str], max_concurrency: int = API_BURST, return_exceptions: bool = False) -> AsyncIterator[tuple]:
+    """
+    Asynchronous counterpart of `extract_outcome_for_specific_crime` for many crimes.
+
+    Returns
+    -
+    An asynchronous iterator of ({'crime_id': crime_id}, outcomes) tuples, in the order in which the requests finish.
+    """
+    return _extract_many(extract_outcome_for_specific_crime, ({'crime_id': crime_id} for crime_id in crime_ids), max_concurrency, return_exceptions)
+
+
+
+# status of the crimes-street endpoint when a custom area contains more than 10,000 crimes
+TOO_MANY_CRIMES_STATUS = 503
+
+# the same status is returned when the API is briefly unavailable, a 503 whose body does not say that the area is too large
+# is tried again this many times before the tile is split
+TOO_MANY_CRIMES_RETRIES = 2
+
+# the body of a 503 that refuses an area because of its size
+TOO_MANY_CRIMES_PATTERN = re.compile(r'too (many|large|big)|more than 10,?000|limit', re.IGNORECASE)
+
+
+def too_many_crimes(response: requests.Response) -> bool:
+    """Whether the API refused a custom area because it contains more than 10,000 crimes (and not because it is unavailable)."""
+    return response.status_code == TOO_MANY_CRIMES_STATUS and TOO_MANY_CRIMES_PATTERN.search(response.text or '') is not None
+
+
+def split_tile(tile: Polygon) -> list:
+    """
+    Splits a tile into the quarters of its envelope (halves when it is long and narrow) with `get_squares_from_rect`,
+    clipped to the tile such that the quarters together cover exactly the tile.
+    """
+    min_x, min_y, max_x, max_y = tile.bounds
+    squares = get_squares_from_rect(tile.envelope, side_length=max(max_x - min_x, max_y - min_y) / 2)
+
+    # a clipped square may be a collection of polygons and the lines or points where it touches the tile,
+    # every polygon part is kept such that no area of the tile is lost
+    parts = shapely.get_parts(shapely.intersection(squares, tile))
+    quarters = [part for part in parts if isinstance(part, Polygon) and not part.is_empty]
+
+    if abs(sum(quarter.area for quarter in quarters) - tile.area) > 1e-9 * max(tile.area, 1):
+        raise ValueError(f"The quarters of the tile {tile.bounds} do not cover it")
+    return quarters
+
+
+def extract_street_level_crimes_tiled(polygon, date: str = None, crime_type: str = None, max_concurrency: int = API_BURST, max_depth: int = 8, max_requests: int = 2000, output: str = 'json') -> list:
+    """
+    Extracts the street-level crimes of an area of any size, e.g. a whole borough, in one call.
+
+    The area is requested as one custom area first. When the API refuses a tile because it contains more than
+    10,000 crimes (HTTP 503 saying so, other 503s are tried again TOO_MANY_CRIMES_RETRIES times first as the API
+    also answers 503 when it is briefly unavailable), the tile is split into quarters (see `split_tile`) and the quarters are requested,
+    so dense areas are subdivided adaptively and sparse areas cost a single request. Tiles are fetched concurrently,
+    crimes on the border of two tiles are returned once (deduplicated by `persistent_id`, or `id` when it is empty).
+
+    Parameters
+    -
+    polygon - shapely Polygon or MultiPolygon in lng/lat order (as read from a GeoJSON file), or a list of (lat, lng) pairs\n
+    date - "YYYY-MM" Limit results to a specific month, the latest month by default (optional)\n
+    crime_type - The type of crime (optional)\n
+    max_concurrency - maximum number of requests in flight (optional)\n
+    max_depth - how many times a tile may be split before giving up (optional)\n
+    max_requests - how many requests the whole area may take before giving up (optional)\n
+    output - "json" (list of dictionaries), "table" (flat pyarrow Table) or "pandas" (flat DataFrame), see functions/table_func.py (optional)
+
+    Returns
+    -
+    A list of dictionaries containing the street-level crimes of the area.
+
+    Raises
+    -
+    requests.HTTPError - If a request fails, or a tile still contains more than 10,000 crimes after `max_depth` splits.\n
+    RuntimeError - If the area takes more than `max_requests` requests.
+
+    Examples
+    -
+    ```python
+    borough = neighbourhoods[neighbourhoods['borough'] == 'Westminster'].unary_union
+    crimes = extract_street_level_crimes_tiled(borough, date='2023-12')
+    ```
+    """
+    # raises on an unknown output before any request is sent
+    response_parser('crime', output)
+
+    if isinstance(polygon, MultiPolygon):
+        tiles = list(polygon.geoms)
+    elif isinstance(polygon, Polygon):
+        tiles = [polygon]
+    else:
+        tiles = [Polygon([(lng, lat) for lat, lng in polygon])]
+
+    # a refused tile is tried again or split here, not in functions/http_func
+    retry_on = tuple(status for status in RETRY_STATUS if status != TOO_MANY_CRIMES_STATUS)
+    results = []
+    n_requests = 0
+
+    def fetch(tile: Polygon, delay: float):
+        time.sleep(delay)
+        # the tiles are parsed into tables straight from the responses unless dictionaries are requested
+        return extract_street_level_crimes(poly=tile, date=date, crime_type=crime_type, retry_on=retry_on,
+                                           output='json' if output == 'json' else 'table')
+
+    with ThreadPoolExecutor(max_workers=max_concurrency) as pool:
+        def submit(tile: Polygon, depth: int, attempt: int = 0):
+            nonlocal n_requests
+            n_requests += 1
+            if n_requests > max_requests:
+                raise RuntimeError(f"The area takes more than {max_requests} requests, split it or raise max_requests")
+            future = pool.submit(fetch, tile, 2 ** attempt if attempt else 0)
+            running[future] = (tile, depth, attempt)
+
+        running = {}
+        try:
+            for tile in tiles:
+                submit(tile, 0)
+
+            while running:
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    tile, depth, attempt = running.pop(future)
+                    try:
+                        result = future.result()
+                    except requests.HTTPError as e:
+                        if e.response is None or e.response.status_code != TOO_MANY_CRIMES_STATUS:
+                            raise
+                        if not too_many_crimes(e.response) and attempt < TOO_MANY_CRIMES_RETRIES:
+                            submit(tile, depth, attempt + 1)
+                        elif depth < max_depth:
+                            for quarter in split_tile(tile):
+                                submit(quarter, depth + 1)
+                        else:
+                            raise
+                        continue
+
+                    results.append(result)
+        finally:
+            for future in running:
+                future.cancel()
+
+    if output == 'json':
+        crimes = {}
+        for result in results:
+            for crime in result:
+                crimes[crime.get('persistent_id') or crime['id']] = crime
+        return list(crimes.values())
+
+    table = drop_duplicate_crimes(concat_tables(results))
+    return table.to_pandas() if output == 'pandas' else table
+
+
+def _resolve_outcome(crime_id: str) -> tuple:
+    # the outcomes are kept in the outcome store, not in the http cache
+    try:
+        outcomes = extract_outcome_for_specific_crime(crime_id, ttl=0).get('outcomes', [])
+    except requests.HTTPError as e:
+        # crimes without outcomes (yet) are unknown to the endpoint
+        if e.response is None or e.response.status_code != 404:
+            raise
+        outcomes = []
+
+    outcomes = sorted(outcomes, key=lambda outcome: outcome.get('date') or '')
+    last_outcome = outcomes[-1]['category']['code'] if outcomes else None
+    final = last_outcome is not None and last_outcome not in OPEN_OUTCOME_CATEGORIES
+    return crime_id, last_outcome, json.dumps(outcomes), final
+
+
+def resolve_crime_outcomes(crime_ids: Iterable[str], store_path: str = OUTCOME_STORE, max_concurrency: int = API_BURST, refresh_days: float = OUTCOME_REFRESH_DAYS, batch_size: int = 1000) -> pd.DataFrame:
+    """
+    Resolves the outcomes of many crimes (e.g. the `Crime ID` column of a month of street crimes) through a local store.
 
-    return list_of_dicts
+    Crimes whose outcomes are stored and final (the last outcome is not one of OPEN_OUTCOME_CATEGORIES) are never
+    requested again, open cases are requested again once their outcomes are older than `refresh_days`.
+    The remaining crimes are requested concurrently under the rate limit of the API and written to the store in batches,
+    such that an interrupted run keeps what it resolved.
 
+    Parameters
+    -
+    crime_ids - iterable of crime ids, missing and empty ids are skipped\n
+    store_path - path of the SQLite outcome store (optional)\n
+    max_concurrency - maximum number of requests in flight (optional)\n
+    refresh_days - days after which the outcomes of open cases are requested again (optional)\n
+    batch_size - number of resolved crimes written to the store at once (optional)
+
+    Returns
+    -
+    A DataFrame with the columns crime_id, last_outcome (category code), outcomes (json), final and resolved_at (unix time),
+    one row per distinct crime id.
+
+    Examples
+    -
+    ```python
+    df = read_met_crime(open_met_crime_store(), columns=['Crime ID'], months=['2023-12'])
+    outcomes = resolve_crime_outcomes(df['Crime ID'])
+    ```
+    """
+    crime_ids = list(dict.fromkeys(crime_id for crime_id in crime_ids if isinstance(crime_id, str) and crime_id))
+    conn = open_outcome_store(store_path)
+
+    try:
+        stored = read_outcomes(conn, crime_ids)
+        up_to_date = stored[(stored['final'] == 1) | (stored['resolved_at'] >= time.time() - refresh_days * 24 * 60 * 60)]
+        up_to_date = set(up_to_date['crime_id'])
+        pending = iter([crime_id for crime_id in crime_ids if crime_id not in up_to_date])
+        n_pending = len(crime_ids) - len(up_to_date)
+
+        rows = []
+        with ThreadPoolExecutor(max_workers=max_concurrency) as pool, tqdm(total=n_pending, desc='Resolving outcomes', unit='crime') as bar:
+            # only a window of requests is queued, such that hundreds of thousands of ids do not create as many futures
+            running = set()
+            try:
+                while True:
+                    for crime_id in pending:
+                        running.add(pool.submit(_resolve_outcome, crime_id))
+                        if len(running) >= max_concurrency * 4:
+                            break
+                    if not running:
+                        break
+
+                    done, running = wait(running, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        rows.append(future.result())
+                        bar.update(1)
+
+                    if len(rows) >= batch_size:
+                        write_outcomes(conn, rows)
+                        rows = []
+            finally:
+                for future in running:
+                    future.cancel()
+                write_outcomes(conn, rows)
+
+        return read_outcomes(conn, crime_ids)
+    finally:
+        conn.close()
+
+
+def prefetch_force_metadata(force: str = 'metropolitan', max_concurrency: int = API_BURST) -> pd.DataFrame:
+    """
+    Fetches the neighbourhoods of a force with their details, team, events and priorities concurrently into the metadata catalogue,
+    such that later calls of the neighbourhood extractors are served from disk without network access.
+
+    Returns
+    -
+    A DataFrame with the details of every neighbourhood (flattened, e.g. `centre.latitude`)
+    and the columns team_size, n_events and n_priorities, to join against other data by neighbourhood id.
+
+    Examples
+    -
+    ```python
+    neighbourhoods = prefetch_force_metadata(force='metropolitan')
+    ```
+    """
+    neighbourhoods = extract_neighbourhoods_for_a_force(force=force)
+    extractors = {
+        'details': extract_specific_neighbourhoods_for_a_force,
+        'team': extract_neighbourhood_team_for_a_force,
+        'events': extract_neighbourhood_events_for_a_force,
+        'priorities': extract_neighbourhood_priorities_for_a_force,
+    }
+
+    with ThreadPoolExecutor(max_workers=max_concurrency) as pool:
+        futures = {(neighbourhood['id'], kind): pool.submit(extractor, force=force, neighbourhood_id=neighbourhood['id'])
+                   for neighbourhood in neighbourhoods for kind, extractor in extractors.items()}
+        results = {key: future.result() for key, future in futures.items()}
+
+    ids = [neighbourhood['id'] for neighbourhood in neighbourhoods]
+    df = pd.json_normalize([results[(neighbourhood_id, 'details')] for neighbourhood_id in ids])
+    df['id'] = ids
+    df['team_size'] = [len(results[(neighbourhood_id, 'team')]) for neighbourhood_id in ids]
+    df['n_events'] = [len(results[(neighbourhood_id, 'events')]) for neighbourhood_id in ids]
+    df['n_priorities'] = [len(results[(neighbourhood_id, 'priorities')]) for neighbourhood_id in ids]
+    return df
 
 
 def download_file(url, save_dir):
@@ -971,6 +1475,119 @@ def download_file(url, save_dir):
     return save_path
 
 
+
+def stream_download(url: str, save_dir: str, chunk_size: int = 1024 * 1024, expected_sha256: str = None, callback=None, max_retries: int = 5) -> str:
+    """
+    Streams a (large) file from the specified URL to disk chunk by chunk, so memory usage stays flat whatever the file size.
+    A partial download (`<filename>.part`) left by an interrupted run is resumed with an HTTP Range request.
+
+    Parameters
+    -
+    url (str): The URL of the file to be downloaded.\n
+    save_dir (str): The directory where the file will be saved.\n
+    chunk_size (int): Number of bytes read from the socket and written to disk at once.\n
+    expected_sha256 (str): Optional. SHA-256 hex digest the finished file must match.\n
+    callback (callable): Optional. Called with the number of bytes added after every chunk (for progress bars), the calls add up to the size of the file.\n
+    max_retries (int): How many times a dropped connection is resumed before giving up.\n
+
+    Returns
+    -
+    The path of the downloaded file.
+
+    Raises
+    -
+    requests.HTTPError: If the server answers with an error status.\n
+    IOError: If the size of the finished file does not match the size announced by the server.\n
+    ValueError: If the checksum of the finished file does not match `expected_sha256`.
+
+    Examples
+    -
+    To download an archive of the police data, you can use the following code:
+
+    ```python
+    archive_path = stream_download("https://data.police.uk/data/archive/2024-03.zip", "data/archives")
+    ```
+    """
+    filename = url.split('/')[-1]
+    os.makedirs(save_dir, exist_ok=True)
+    save_path = os.path.join(save_dir, filename)
+    part_path = save_path + '.part'
+    checksum_path = save_path + '.sha256'
+
+    # the file was already downloaded and verified by a previous run
+    if os.path.exists(save_path) and os.path.exists(checksum_path):
+        with open(checksum_path) as f:
+            if expected_sha256 is None or f.read().strip() == expected_sha256:
+                return save_path
+
+    # bytes reported to the callback so far, a resumed attempt only reports what it adds
+    reported = 0
+
+    for attempt in range(max_retries + 1):
+        # hash what is already on disk, such that the checksum covers the whole file after a resume
+        offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+        sha256 = hashlib.sha256()
+        if offset:
+            with open(part_path, 'rb') as f:
+                for chunk in iter(lambda: f.read(chunk_size), b''):
+                    sha256.update(chunk)
+
+        headers = {'Range': f'bytes={offset}-'} if offset else {}
+        try:
+            with requests.get(url, headers=headers, stream=True, timeout=(10, 60)) as response:
+                if response.status_code == 416:
+                    # nothing left to request, the partial file is already complete
+                    total = int(response.headers.get('Content-Range', f'*/{offset}').split('/')[-1])
+                elif response.status_code == 206:
+                    start, total = response.headers['Content-Range'].split(' ')[1].split('/')
+                    if int(start.split('-')[0]) != offset:
+                        raise IOError(f"Server resumed {url} at the wrong offset: {start}, expected {offset}")
+                    total = int(total)
+                elif response.status_code == 200:
+                    # the server ignored the Range header, so we start from scratch
+                    offset = 0
+                    sha256 = hashlib.sha256()
+                    total = int(response.headers.get('Content-Length', 0)) or None
+                else:
+                    response.raise_for_status()
+                    raise requests.HTTPError(f"Unexpected status code {response.status_code} for {url}")
+
+                if response.status_code != 416:
+                    # the partial file of a previous run (or minus the bytes dropped when the server ignored the Range header)
+                    if callback is not None and offset != reported:
+                        callback(offset - reported)
+                        reported = offset
+                    with open(part_path, 'ab' if offset else 'wb') as f:
+                        for chunk in response.iter_content(chunk_size=chunk_size):
+                            f.write(chunk)
+                            sha256.update(chunk)
+                            if callback is not None:
+                                callback(len(chunk))
+                                reported += len(chunk)
+            break
+        except (requests.ConnectionError, requests.Timeout, requests.exceptions.ChunkedEncodingError) as e:
+            if attempt == max_retries:
+                raise
+            print(f"Connection to {url} dropped ({e}), resuming download...")
+            time.sleep(2 ** attempt)
+
+    # verify the size and the checksum before the file is moved to its final place
+    size = os.path.getsize(part_path)
+    if total is not None and size != total:
+        raise IOError(f"Downloaded {size} bytes from {url}, expected {total}. Run the download again to resume it.")
+
+    digest = sha256.hexdigest()
+    if expected_sha256 is not None and digest != expected_sha256:
+        os.remove(part_path)
+        raise ValueError(f"Checksum mismatch for {url}: got {digest}, expected {expected_sha256}")
+
+    os.replace(part_path, save_path)
+    with open(checksum_path, 'w') as f:
+        f.write(digest)
+
+    return save_path
+
+
 def proportion_to_color(proportion):
     """
     Converts a proportion value to an RGB color.
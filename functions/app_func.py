@@ -1,11 +1,10 @@
 # Imports
-import geopandas
+import shapely
 
 import numpy as np
 
 from typing import List
-from shapely.ops import split
-from shapely.geometry import MultiPolygon, Polygon, LineString
+from shapely.geometry import Polygon
 
 
 def rhombus(square: Polygon):
@@ -29,6 +28,57 @@ def rhombus(square: Polygon):
     return Rhombus
 
 
+def square_grid(bounds: tuple, side_length: float) -> np.ndarray:
+    """
+    Boxes of (about) `side_length` covering `bounds` (minx, miny, maxx, maxy), built at once with shapely 2 array functions.
+    The number of cells per axis is the rounded ratio of the extent and `side_length` (at least one),
+    such that the cells fit the bounds exactly.
+    """
+    x1, y1, x2, y2 = bounds
+    xcells = max(1, int(np.round((x2 - x1) / side_length)))
+    ycells = max(1, int(np.round((y2 - y1) / side_length)))
+
+    xindices = np.linspace(x1, x2, xcells + 1)
+    yindices = np.linspace(y1, y2, ycells + 1)
+    xmin, ymin = np.meshgrid(xindices[:-1], yindices[:-1])
+    xmax, ymax = np.meshgrid(xindices[1:], yindices[1:])
+
+    return shapely.box(xmin.ravel(), ymin.ravel(), xmax.ravel(), ymax.ravel())
+
+
+def rhombus_grid(bounds: tuple, side_length: float) -> np.ndarray:
+    """
+    The cells of `square_grid` transformed like `rhombus` (sheared at 45 degrees), built at once.
+    """
+    x1, y1, x2, y2 = shapely.bounds(square_grid(bounds, side_length)).T
+    coords = np.stack([
+        np.stack([x2, y1], axis=-1),
+        np.stack([x2, y2], axis=-1),
+        np.stack([x1, y1], axis=-1),
+        np.stack([x1, 2 * y1 - y2], axis=-1),
+    ], axis=1)
+    return shapely.polygons(coords)
+
+
+def hexagon_grid(bounds: tuple, side_length: float) -> np.ndarray:
+    """
+    Flat-topped hexagons with sides of `side_length` covering `bounds` (minx, miny, maxx, maxy), built at once.
+    Columns are 1.5 * `side_length` apart and every other column is shifted by half a row.
+    """
+    x1, y1, x2, y2 = bounds
+    height = np.sqrt(3) * side_length
+
+    columns = np.arange(x1, x2 + 1.5 * side_length, 1.5 * side_length)
+    rows = np.arange(y1 - height / 2, y2 + height, height)
+    cx, cy = np.meshgrid(columns, rows)
+    cy = cy + (np.arange(len(columns)) % 2) * height / 2
+
+    angles = np.arange(6) * np.pi / 3
+    coords = np.stack([cx.ravel()[:, None] + side_length * np.cos(angles),
+                       cy.ravel()[:, None] + side_length * np.sin(angles)], axis=-1)
+    return shapely.polygons(coords)
+
+
 def get_squares_from_rect(RectangularPolygon: Polygon, side_length: float = 0.0025):
     """
     Divide a Rectangle (Shapely Polygon) into squares of equal area.
@@ -36,40 +86,19 @@ def get_squares_from_rect(RectangularPolygon: Polygon, side_length: float = 0.00
     `side_length` : required side of square
 
     """
-    rect_coords = np.array(RectangularPolygon.boundary.coords.xy)
-    y_list = rect_coords[1]
-    x_list = rect_coords[0]
-    y1 = min(y_list)
-    y2 = max(y_list)
-    x1 = min(x_list)
-    x2 = max(x_list)
-    width = x2 - x1
-    height = y2 - y1
-
-    xcells = int(np.round(width / side_length))
-    ycells = int(np.round(height / side_length))
+    return list(square_grid(RectangularPolygon.bounds, side_length))
 
-    yindices = np.linspace(y1, y2, ycells + 1)
-    xindices = np.linspace(x1, x2, xcells + 1)
-    horizontal_splitters = [
-        LineString([(x, yindices[0]), (x, yindices[-1])]) for x in xindices
-    ]
-    vertical_splitters = [
-        LineString([(xindices[0], y), (xindices[-1], y)]) for y in yindices
-    ]
-    result = RectangularPolygon
-    for splitter in vertical_splitters:
-        result = MultiPolygon(split(result, splitter))
-    for splitter in horizontal_splitters:
-        result = MultiPolygon(split(result, splitter))
-    square_polygons = list(result.geoms)
-
-    return square_polygons
+
+GRIDS = {
+    "square": square_grid,
+    "rhombus": rhombus_grid,
+    "hexagon": hexagon_grid,
+}
 
 
 def split_polygon(G: Polygon, side_length: float = 0.025, shape: str = "square", thresh: float = 0.9) -> List:
     """
-    Using a rectangular envelope around `G`, creates a mesh of squares of required length.
+    Using a rectangular envelope around `G`, creates a mesh of cells of required length.
     
     Removes non-intersecting polygons. 
             
@@ -94,24 +123,24 @@ def split_polygon(G: Polygon, side_length: float = 0.025, shape: str = "square",
 
         side_length should be >0 (non-zero positive)
 
-    - `shape` : {square/rhombus}
+    - `shape` : {square/rhombus/hexagon}
         Desired shape of subset geometries. 
 
 
     """
     assert side_length>0, "side_length must be a float>0"
-    Rectangle    = G.envelope
-    squares      = get_squares_from_rect(Rectangle, side_length=side_length)
-    SquareGeoDF  = geopandas.GeoDataFrame(squares).rename(columns={0: "geometry"}).set_geometry('geometry')
-    print(SquareGeoDF.set_geometry('geometry'))
-    Geoms        = SquareGeoDF[SquareGeoDF.intersects(G)].geometry.values
-    if shape == "rhombus":
-        Geoms = [rhombus(g) for g in Geoms]
-        geoms_ = [g for g in Geoms if ((g.intersection(G)).area / g.area) >= thresh]
-    elif shape == "square":
-        geoms_ = [g for g in Geoms if ((g.intersection(G)).area / g.area) >= thresh]
-
-    geoms = []
-    for polygon in geoms_:
-        geoms.append(list(polygon.exterior.coords))
-    return geoms
\ No newline at end of file
+    assert shape in GRIDS, f"shape must be one of {list(GRIDS)}"
+
+    cells = GRIDS[shape](G.bounds, side_length)
+
+    # the tests against G are done for all cells at once
+    shapely.prepare(G)
+    cells = cells[shapely.intersects(G, cells)]
+
+    # only the cells on the boundary of G need the area of their intersection
+    ratio = np.ones(len(cells))
+    boundary = ~shapely.contains_properly(G, cells)
+    ratio[boundary] = shapely.area(shapely.intersection(cells[boundary], G)) / shapely.area(cells[boundary])
+    geoms_ = cells[ratio >= thresh]
+
+    return [list(polygon.exterior.coords) for polygon in geoms_]
@@ -0,0 +1,55 @@
+# Imports
+import os
+import sys
+
+import pandas as pd
+
+# modifying the root path for imports
+current = os.path.dirname(os.path.realpath(__file__))
+parent = os.path.dirname(current)
+sys.path.append(parent)
+
+from config import BOROUGHS, BOROUGH_ALIASES
+
+
+# the boroughs in the order of their ONS codes, all frames use the same categories
+# such that filters and joins on the borough compare the integer codes
+BOROUGH_DTYPE = pd.CategoricalDtype(list(BOROUGHS.values()))
+
+# canonical name -> ONS code
+BOROUGH_CODES = {name: code for code, name in BOROUGHS.items()}
+
+# the files which define the borough names, data written with older names is stale when they change
+BOROUGH_SOURCES = [os.path.join(parent, 'config.py'), os.path.realpath(__file__)]
+
+
+def canonical_borough(name: str):
+    """
+    The canonical name of a borough as it is written in any of the sources (see BOROUGH_ALIASES in config),
+    None when it is not a London borough.
+    """
+    if not isinstance(name, str):
+        return None
+    name = BOROUGH_ALIASES.get(name.strip(), name.strip())
+    return name if name in BOROUGH_CODES else None
+
+
+def to_boroughs(values) -> pd.Series:
+    """
+    Converts borough names as they are written in any of the sources into the borough categorical (BOROUGH_DTYPE),
+    only the distinct names are looked up. Names that are not London boroughs become missing.
+
+    Examples
+    -
+    ```python
+    df['Borough'] = to_boroughs(df['Borough'])
+    ```
+    """
+    values = pd.Series(values)
+    mapping = {name: canonical_borough(name) for name in values.dropna().unique()}
+    return values.map(mapping).astype(BOROUGH_DTYPE)
+
+
+def borough_codes(boroughs: pd.Series) -> pd.Series:
+    """The ONS codes (E09000001 - E09000033) of the boroughs of `to_boroughs`."""
+    return boroughs.map(BOROUGH_CODES)
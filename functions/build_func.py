@@ -0,0 +1,256 @@
+# Imports
+import os
+import sys
+import glob
+import json
+import hashlib
+import threading
+import subprocess
+
+from typing import List
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+# modifying the root path for imports
+current = os.path.dirname(os.path.realpath(__file__))
+parent = os.path.dirname(current)
+sys.path.append(parent)
+
+from config import PAS_WARD_LEVEL_FILES
+from functions.geo_func import NEIGHBOURHOODS_GEOJSON, NEIGHBOURHOODS_LOD, BOROUGHS_LOD
+from functions.store_func import MANIFEST_NAME, MET_CRIME_STORE, MET_CRIME_HEX_TABLE, PAS_WARD_LEVEL_STORE, PAS_CRIME_TABLE
+
+
+# the preprocessors use paths relative to the root of the repository
+ROOT = parent
+
+# content hashes of the inputs and the inputs every output was built from
+BUILD_STATE = 'data/build_state.json'
+
+
+class Node:
+    """
+    One stage of the build graph: a preprocessor script with the files it reads and the files it writes.
+
+    Parameters
+    -
+    name - name of the stage, used on the command line\n
+    script - the preprocessor which is run as `python <script>` from the root of the repository\n
+    inputs - files, directories or glob patterns which are read by the script (the script itself is always an input)\n
+    outputs - files or directories which are written by the script
+    """
+    def __init__(self, name: str, script: str, inputs: List[str], outputs: List[str]):
+        self.name = name
+        self.script = script
+        self.inputs = [script] + list(inputs)
+        self.outputs = list(outputs)
+
+    def __repr__(self):
+        return f'Node({self.name!r})'
+
+
+# the stages of the data preparation, the order of the stages follows from their inputs and outputs
+BUILD_GRAPH = [
+    Node('pas_ward_level', 'data_preprocessors/PAS_ward_level_preprocessor.py',
+         inputs=list(PAS_WARD_LEVEL_FILES.values()) + ['config.py', 'functions/borough_func.py'],
+         outputs=['data/pas_data_ward_level/pre_final.csv', PAS_WARD_LEVEL_STORE]),
+    Node('pas_crime', 'data_preprocessors/PAS_crime_preprocessor.py',
+         inputs=[PAS_WARD_LEVEL_STORE],
+         outputs=[PAS_CRIME_TABLE]),
+    Node('met_crime', 'data_preprocessors/MET_crime_preprocessor.py',
+         inputs=['data/met_data/*/*-metropolitan-street.csv', f'data/met_data/{MANIFEST_NAME}', 'functions/store_func.py', 'functions/borough_func.py', 'config.py'],
+         outputs=[MET_CRIME_STORE]),
+    Node('met_crime_hex', 'data_preprocessors/MET_hex_preprocessor.py',
+         inputs=[MET_CRIME_STORE, 'config.py'],
+         outputs=[MET_CRIME_HEX_TABLE]),
+    Node('neighbourhoods', 'data_preprocessors/neighbourhoods_preprocessor.py',
+         inputs=[NEIGHBOURHOODS_GEOJSON, 'functions/geo_func.py', 'functions/borough_func.py', 'config.py'],
+         outputs=[NEIGHBOURHOODS_LOD, BOROUGHS_LOD]),
+]
+
+_lock = threading.Lock()
+
+
+def _root_path(path: str) -> str:
+    return os.path.join(ROOT, path)
+
+
+def expand_paths(patterns: List[str]) -> List[str]:
+    """
+    Lists the files behind `patterns` (files, directories and glob patterns) relative to the root, sorted and without duplicates.
+    Temporary files of interrupted writes are left out.
+    """
+    files = set()
+    for pattern in patterns:
+        for path in glob.glob(_root_path(pattern)):
+            if os.path.isdir(path):
+                for root, dirs, names in os.walk(path):
+                    files.update(os.path.join(root, name) for name in names)
+            else:
+                files.add(path)
+
+    return sorted(os.path.relpath(path, ROOT) for path in files if not path.endswith('.tmp'))
+
+
+def file_hash(path: str, cache: dict) -> str:
+    """
+    SHA-256 of the content of a file, `cache` maps paths to their last known size, mtime and hash,
+    such that only files whose size or mtime changed are read again.
+    """
+    stat = os.stat(_root_path(path))
+    known = cache.get(path)
+    if known is not None and known['size'] == stat.st_size and known['mtime'] == stat.st_mtime_ns:
+        return known['sha256']
+
+    sha256 = hashlib.sha256()
+    with open(_root_path(path), 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            sha256.update(chunk)
+
+    cache[path] = {'size': stat.st_size, 'mtime': stat.st_mtime_ns, 'sha256': sha256.hexdigest()}
+    return cache[path]['sha256']
+
+
+def inputs_hash(node: Node, cache: dict) -> str:
+    """Hash over the names and contents of all input files of a node."""
+    sha256 = hashlib.sha256()
+    for path in expand_paths(node.inputs):
+        sha256.update(f'{path}\0{file_hash(path, cache)}\n'.encode())
+    return sha256.hexdigest()
+
+
+def read_state() -> dict:
+    path = _root_path(BUILD_STATE)
+    if not os.path.exists(path):
+        return {'files': {}, 'nodes': {}}
+
+    with open(path) as f:
+        return json.load(f)
+
+
+def write_state(state: dict):
+    path = _root_path(BUILD_STATE)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(state, f, indent=1, sort_keys=True)
+    os.replace(tmp_path, path)
+
+
+def files_changed(files: dict, written: dict) -> bool:
+    """Whether `file_hash` added or refreshed an entry of the file hashes since they were `written` (a copy of the dictionary)."""
+    return files.keys() != written.keys() or any(files[path] is not entry for path, entry in written.items())
+
+
+def upstream(node: Node, graph: List[Node] = BUILD_GRAPH) -> List[Node]:
+    """The nodes that write one of the inputs of `node`."""
+    return [other for other in graph if other is not node and any(
+        os.path.normpath(pattern) == os.path.normpath(output) or os.path.normpath(pattern).startswith(os.path.normpath(output) + os.sep)
+        for pattern in node.inputs for output in other.outputs)]
+
+
+def select(targets: List[str] = None, graph: List[Node] = BUILD_GRAPH) -> List[Node]:
+    """
+    The nodes needed for `targets` (names of nodes): the targets and everything upstream of them, all nodes when None.
+
+    Raises
+    -
+    ValueError - If a target is not a node of the graph.
+    """
+    if targets is None:
+        return list(graph)
+
+    by_name = {node.name: node for node in graph}
+    unknown = [target for target in targets if target not in by_name]
+    if unknown:
+        raise ValueError(f"Unknown build targets {unknown}, choose from {list(by_name)}")
+
+    selected, stack = [], [by_name[target] for target in targets]
+    while stack:
+        node = stack.pop()
+        if node not in selected:
+            selected.append(node)
+            stack.extend(upstream(node, graph))
+    return [node for node in graph if node in selected]
+
+
+def is_stale(node: Node, state: dict) -> bool:
+    """A node is stale when one of its outputs is missing or its inputs changed since it was last built."""
+    if not all(os.path.exists(_root_path(output)) for output in node.outputs):
+        return True
+    return state['nodes'].get(node.name) != inputs_hash(node, state['files'])
+
+
+def run_node(node: Node) -> int:
+    """Runs the script of a node in its own interpreter, returns the exit code."""
+    return subprocess.run([sys.executable, node.script], cwd=ROOT).returncode
+
+
+def build(targets: List[str] = None, force: bool = False, max_workers: int = None, graph: List[Node] = BUILD_GRAPH) -> dict:
+    """
+    Brings the outputs of `targets` (all nodes when None) up to date.
+
+    A node is rebuilt when one of its outputs is missing or the content of one of its inputs changed,
+    nodes whose inputs are written by other nodes wait for them, independent nodes run at the same time.
+
+    Parameters
+    -
+    targets - names of the nodes to build, their upstream nodes are built as well (optional)\n
+    force - rebuild the selected nodes even if they are up to date (optional)\n
+    max_workers - maximum number of nodes that run at the same time (optional)
+
+    Returns
+    -
+    A dictionary with the status of every selected node: "up to date", "built", "failed" or "skipped" (an upstream node failed).
+
+    Examples
+    -
+    ```python
+    build(['pas_crime'])
+    ```
+    """
+    nodes = select(targets, graph)
+    dependencies = {node: [other for other in upstream(node, graph) if other in nodes] for node in nodes}
+    status = {}
+
+    with _lock, ThreadPoolExecutor(max_workers=max_workers or len(nodes) or 1) as pool:
+        state = read_state()
+        written = dict(state['files'])
+        running = {}
+
+        while len(status) < len(nodes):
+            for node in nodes:
+                if node.name in status or node in running.values():
+                    continue
+                if any(status.get(other.name) in ('failed', 'skipped') for other in dependencies[node]):
+                    status[node.name] = 'skipped'
+                elif all(other.name in status for other in dependencies[node]):
+                    # inputs are hashed only once the upstream nodes are done
+                    if force or is_stale(node, state):
+                        print(f'Building {node.name} ({node.script})')
+                        running[pool.submit(run_node, node)] = node
+                    else:
+                        status[node.name] = 'up to date'
+
+            if not running:
+                if len(status) < len(nodes) and not any(node.name not in status and all(other.name in status for other in dependencies[node]) for node in nodes):
+                    raise ValueError(f"The build graph has a cycle between {[node.name for node in nodes if node.name not in status]}")
+                continue
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                node = running.pop(future)
+                if future.result() == 0 and all(os.path.exists(_root_path(output)) for output in node.outputs):
+                    state['nodes'][node.name] = inputs_hash(node, state['files'])
+                    status[node.name] = 'built'
+                else:
+                    state['nodes'].pop(node.name, None)
+                    status[node.name] = 'failed'
+                    print(f'{node.name} failed, the nodes that depend on it are skipped')
+                write_state(state)
+                written = dict(state['files'])
+
+        # files whose mtime changed without a change of their content are rehashed once, not on every build
+        if files_changed(state['files'], written):
+            write_state(state)
+
+    return status
@@ -0,0 +1,336 @@
+# Imports
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+import shapely
+import geopandas as gpd
+
+from shapely import STRtree
+from shapely.geometry import Polygon
+from concurrent.futures import ThreadPoolExecutor
+
+# modifying the root path for imports
+current = os.path.dirname(os.path.realpath(__file__))
+parent = os.path.dirname(current)
+sys.path.append(parent)
+
+from config import API_BURST, HEX_BASE_SIZE
+from functions.api_func import extract_neighbourhoods_for_a_force, extract_neighbourhood_boundary_for_a_force
+
+
+# neighbourhood boundaries of the London boroughs (columns borough, name)
+NEIGHBOURHOODS_GEOJSON = 'data/neighbourhoods_boundary.geojson'
+
+# simplified neighbourhood boundaries at several levels of detail and the boroughs dissolved from them (GeoParquet)
+NEIGHBOURHOODS_LOD = 'data/neighbourhoods_lod.parquet'
+BOROUGHS_LOD = 'data/boroughs_lod.parquet'
+
+# simplification tolerance (degrees) of every level of detail, level 1 is below a pixel at the zoom of the maps of the application
+LOD_TOLERANCES = {0: 0.0001, 1: 0.0005, 2: 0.002}
+MAP_LOD = 1
+
+# the simplified coverage may change the total area and overlap itself by at most these fractions of the total area
+COVERAGE_AREA_TOLERANCE = 0.01
+COVERAGE_OVERLAP_TOLERANCE = 1e-4
+
+# neighbourhood boundaries of a force downloaded from the API, one GeoParquet file per force
+FORCE_BOUNDARIES = 'data/met_data/{force}_neighbourhood_boundaries.parquet'
+
+
+def fetch_force_boundaries(force: str = 'metropolitan', max_concurrency: int = API_BURST, refresh: bool = False) -> gpd.GeoDataFrame:
+    """
+    Downloads the boundaries of all neighbourhoods of a force (concurrently, under the rate limit of the API)
+    and keeps them on disk, later calls read them from disk without network access.
+
+    Returns
+    -
+    A GeoDataFrame with the columns force, neighbourhood (id), name and geometry (lng/lat).
+    """
+    path = FORCE_BOUNDARIES.format(force=force)
+    if os.path.exists(path) and not refresh:
+        return gpd.read_parquet(path)
+
+    neighbourhoods = extract_neighbourhoods_for_a_force(force=force)
+
+    def boundary(neighbourhood: dict) -> Polygon:
+        points = extract_neighbourhood_boundary_for_a_force(force=force, neighbourhood_id=neighbourhood['id'])
+        return Polygon([(float(point['longitude']), float(point['latitude'])) for point in points])
+
+    with ThreadPoolExecutor(max_workers=max_concurrency) as pool:
+        geometries = list(pool.map(boundary, neighbourhoods))
+
+    boundaries = gpd.GeoDataFrame({'force': force,
+                                   'neighbourhood': [neighbourhood['id'] for neighbourhood in neighbourhoods],
+                                   'name': [neighbourhood['name'] for neighbourhood in neighbourhoods]},
+                                  geometry=geometries, crs='EPSG:4326')
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    boundaries.to_parquet(path + '.tmp')
+    os.replace(path + '.tmp', path)
+
+    return boundaries
+
+def simplify_coverage(geometries, tolerance: float) -> np.ndarray:
+    """
+    Simplifies polygons that share their borders (a coverage, e.g. the neighbourhoods) such that neighbours keep
+    sharing exactly the same simplified border, without gaps or overlaps between them.
+
+    Like the shared arcs of TopoJSON: the borders are split into arcs between the points where three or more polygons meet,
+    every arc is simplified once (arcs that would cross a neighbouring arc keep their vertices), and the polygons are rebuilt
+    from the simplified arcs, every face going to the polygon it overlaps most.
+    Polygons that collapse at `tolerance` are simplified on their own instead. The result is checked with `check_coverage`.
+
+    Returns
+    -
+    An array with the simplified geometry of every polygon, in the order of `geometries`.
+    """
+    geometries = np.asarray(geometries)
+
+    arcs = shapely.get_parts(shapely.line_merge(shapely.union_all(shapely.boundary(geometries))))
+    simplified_arcs = shapely.simplify(arcs, tolerance, preserve_topology=True)
+
+    # arcs are simplified independently and may cross their neighbours, which would merge or split faces,
+    # such arcs keep their original vertices until no two arcs meet outside their end points
+    while True:
+        left, right = STRtree(simplified_arcs).query(simplified_arcs, predicate='intersects')
+        pairs = left < right
+        left, right = left[pairs], right[pairs]
+        crossing = ~shapely.touches(simplified_arcs[left], simplified_arcs[right])
+        crossing = np.unique(np.concatenate([left[crossing], right[crossing]]))
+        crossing = crossing[~shapely.equals_exact(simplified_arcs[crossing], arcs[crossing], 0)]
+        if not len(crossing):
+            break
+        simplified_arcs[crossing] = arcs[crossing]
+
+    faces = shapely.get_parts(shapely.polygonize(simplified_arcs))
+
+    # every face belongs to the polygon it overlaps most, a point of the face may lie in a neighbour once the arcs moved;
+    # faces that lie mostly outside all polygons (gaps of the coverage) are left out
+    face_index, geometry_index = STRtree(geometries).query(faces, predicate='intersects')
+    overlap = shapely.area(shapely.intersection(faces[face_index], geometries[geometry_index]))
+    order = np.lexsort((-overlap, face_index))
+    face_index, geometry_index, overlap = face_index[order], geometry_index[order], overlap[order]
+    face_index, first = np.unique(face_index, return_index=True)
+    geometry_index, overlap = geometry_index[first], overlap[first]
+    inside = overlap > shapely.area(faces[face_index]) / 2
+    face_index, geometry_index = face_index[inside], geometry_index[inside]
+
+    simplified = shapely.simplify(geometries, tolerance, preserve_topology=True)
+    for index in np.unique(geometry_index):
+        parts = faces[face_index[geometry_index == index]]
+        simplified[index] = parts[0] if len(parts) == 1 else shapely.union_all(parts)
+
+    check_coverage(geometries, simplified)
+    return simplified
+
+
+def check_coverage(geometries, simplified):
+    """
+    Checks that a simplified coverage keeps the total area of the original polygons (COVERAGE_AREA_TOLERANCE)
+    and that its polygons do not overlap (COVERAGE_OVERLAP_TOLERANCE).
+
+    Raises
+    -
+    ValueError - If the total area changed or the polygons overlap by more than the tolerances.
+    """
+    area = shapely.union_all(geometries).area
+    union_area = shapely.union_all(simplified).area
+    overlap = shapely.area(simplified).sum() - union_area
+
+    if abs(union_area - area) > COVERAGE_AREA_TOLERANCE * area:
+        raise ValueError(f"The simplified coverage changed the total area by {abs(union_area - area) / area:.2%}")
+    if overlap > COVERAGE_OVERLAP_TOLERANCE * area:
+        raise ValueError(f"The simplified polygons overlap by {overlap / area:.2%} of the total area")
+
+
+def build_levels_of_detail(neighbourhoods: gpd.GeoDataFrame, tolerances: dict = LOD_TOLERANCES) -> tuple:
+    """
+    Simplifies the neighbourhoods at every level of detail (see simplify_coverage) and dissolves them into boroughs.
+
+    Returns
+    -
+    Two GeoDataFrames: the neighbourhoods (level, borough, name, geometry) and the boroughs (level, borough, geometry).
+    """
+    neighbourhood_levels, borough_levels = [], []
+    for level, tolerance in tolerances.items():
+        simplified = gpd.GeoDataFrame(neighbourhoods[['borough', 'name']].assign(level=level),
+                                      geometry=simplify_coverage(neighbourhoods.geometry.values, tolerance), crs=neighbourhoods.crs)
+        neighbourhood_levels.append(simplified)
+        # the neighbourhoods share their simplified borders exactly, so their union has no slivers
+        borough_levels.append(simplified.dissolve(by=['level', 'borough'], as_index=False, observed=True)[['level', 'borough', 'geometry']])
+
+    return pd.concat(neighbourhood_levels, ignore_index=True), pd.concat(borough_levels, ignore_index=True)
+
+
+def read_levels_of_detail(path: str = NEIGHBOURHOODS_LOD, level: int = MAP_LOD) -> gpd.GeoDataFrame:
+    """
+    Reads one level of detail of the simplified neighbourhoods (NEIGHBOURHOODS_LOD) or boroughs (BOROUGHS_LOD).
+
+    Examples
+    -
+    ```python
+    boroughs = read_levels_of_detail(BOROUGHS_LOD, level=2)
+    ```
+    """
+    return gpd.read_parquet(path, filters=[('level', '=', level)]).reset_index(drop=True)
+
+
+# the hexagonal grid is laid over an equirectangular projection around central London (metres per degree)
+HEX_ORIGIN = (51.5, -0.1)
+_METRES_PER_LAT = 110574.0
+_METRES_PER_LNG = 111320.0 * np.cos(np.radians(HEX_ORIGIN[0]))
+
+# a cell id packs the resolution and the axial coordinates (q, r) of the hexagon into one integer
+_AXIAL_BITS = 24
+_AXIAL_OFFSET = 1 << (_AXIAL_BITS - 1)
+_AXIAL_MASK = (1 << _AXIAL_BITS) - 1
+
+
+def hex_size(resolution: int) -> float:
+    """The side (and circumradius) in metres of the hexagons of `resolution`, it halves with every resolution."""
+    return HEX_BASE_SIZE / 2 ** resolution
+
+
+def hex_cells(lat, lng, resolution: int) -> np.ndarray:
+    """
+    Assigns every point to its pointy-topped hexagon of `resolution`, for arrays of any length at once.
+
+    Parameters
+    -
+    lat - array of latitudes\n
+    lng - array of longitudes\n
+    resolution - 0 for the largest hexagons (sides of HEX_BASE_SIZE metres), every next resolution halves the side
+
+    Returns
+    -
+    An array of cell ids (int64), -1 for points without coordinates.
+    """
+    lat = np.asarray(lat, dtype=np.float64)
+    lng = np.asarray(lng, dtype=np.float64)
+    size = hex_size(resolution)
+    x = (lng - HEX_ORIGIN[1]) * _METRES_PER_LNG
+    y = (lat - HEX_ORIGIN[0]) * _METRES_PER_LAT
+
+    # fractional axial coordinates, rounded to the nearest hexagon in cube coordinates (q + r + s = 0)
+    q = (np.sqrt(3) / 3 * x - y / 3) / size
+    r = (2 / 3 * y) / size
+    s = -q - r
+    rq, rr, rs = np.round(q), np.round(r), np.round(s)
+    dq, dr, ds = np.abs(rq - q), np.abs(rr - r), np.abs(rs - s)
+    rq = np.where((dq > dr) & (dq > ds), -rr - rs, rq)
+    rr = np.where((dr > dq) & (dr >= ds), -rq - rs, rr)
+
+    valid = np.isfinite(rq) & np.isfinite(rr)
+    rq = np.where(valid, rq, 0).astype(np.int64)
+    rr = np.where(valid, rr, 0).astype(np.int64)
+    cells = (np.int64(resolution) << (2 * _AXIAL_BITS)) | ((rq + _AXIAL_OFFSET) << _AXIAL_BITS) | (rr + _AXIAL_OFFSET)
+    return np.where(valid, cells, -1)
+
+
+def _axial(cells) -> tuple:
+    cells = np.asarray(cells, dtype=np.int64)
+    resolution = cells >> (2 * _AXIAL_BITS)
+    q = ((cells >> _AXIAL_BITS) & _AXIAL_MASK) - _AXIAL_OFFSET
+    r = (cells & _AXIAL_MASK) - _AXIAL_OFFSET
+    return resolution, q, r
+
+
+def hex_centres(cells) -> tuple:
+    """The latitudes and longitudes of the centres of `cells`."""
+    resolution, q, r = _axial(cells)
+    size = HEX_BASE_SIZE / 2.0 ** resolution
+    x = size * np.sqrt(3) * (q + r / 2)
+    y = size * 1.5 * r
+    return y / _METRES_PER_LAT + HEX_ORIGIN[0], x / _METRES_PER_LNG + HEX_ORIGIN[1]
+
+
+def hex_parents(cells, resolution: int) -> np.ndarray:
+    """
+    The cells of the coarser `resolution` that contain the centres of `cells`, such that the counts of a fine
+    resolution can be rolled up to any coarser one.
+    """
+    lat, lng = hex_centres(cells)
+    return hex_cells(lat, lng, resolution)
+
+
+def hex_polygons(cells) -> np.ndarray:
+    """The hexagons of `cells` as an array of shapely Polygons (lng/lat), e.g. to draw a density layer."""
+    resolution, q, r = _axial(cells)
+    size = HEX_BASE_SIZE / 2.0 ** resolution
+    lat, lng = hex_centres(cells)
+
+    angles = np.radians(np.arange(6) * 60 + 30)
+    coords = np.stack([lng[:, None] + (size[:, None] * np.cos(angles)) / _METRES_PER_LNG,
+                       lat[:, None] + (size[:, None] * np.sin(angles)) / _METRES_PER_LAT], axis=-1)
+    return shapely.polygons(coords)
+
+
+class NeighbourhoodGeocoder:
+    """
+    Local point-in-polygon lookup of neighbourhoods, replaces a /locate-neighbourhood request per point.
+
+    The boundaries are indexed in an STRtree once, points are then matched in bulk (vectorised shapely 2),
+    so millions of points are assigned in seconds.
+
+    Examples
+    -
+    ```python
+    geocoder = NeighbourhoodGeocoder.from_geojson()
+    df = geocoder.locate_frame(read_met_crime(open_met_crime_store(), months=['2023-12']))
+    ```
+    """
+    def __init__(self, boundaries: gpd.GeoDataFrame):
+        self.boundaries = boundaries.reset_index(drop=True)
+        self.geometries = self.boundaries.geometry.values
+        self.tree = STRtree(self.geometries)
+
+    @classmethod
+    def from_geojson(cls, path: str = NEIGHBOURHOODS_GEOJSON):
+        """Geocoder over the neighbourhoods of the London boroughs (see preprocess_neighbourhoods in app/app_data_preprocessor.py)."""
+        return cls(gpd.read_file(path))
+
+    @classmethod
+    def from_force(cls, force: str = 'metropolitan'):
+        """Geocoder over the neighbourhoods of a force as published by the API, downloaded once (see fetch_force_boundaries)."""
+        return cls(fetch_force_boundaries(force))
+
+    def locate(self, lat, lng) -> np.ndarray:
+        """
+        Finds the neighbourhood of every point.
+
+        Parameters
+        -
+        lat - array of latitudes\n
+        lng - array of longitudes
+
+        Returns
+        -
+        An array with, for every point, the row of its neighbourhood in `self.boundaries`,
+        -1 for points outside all neighbourhoods or without coordinates.
+        """
+        lat = np.asarray(lat, dtype=float)
+        lng = np.asarray(lng, dtype=float)
+        points = shapely.points(lng, lat)
+
+        # pairs of (point, neighbourhood) for every point that lies within or on the boundary of a neighbourhood,
+        # crimes are snapped to streets and borders often follow streets
+        point_index, geometry_index = self.tree.query(points, predicate='intersects')
+
+        result = np.full(len(points), -1, dtype=np.int64)
+        # points on a shared border match two neighbourhoods, the first match is kept
+        result[point_index[::-1]] = geometry_index[::-1]
+        return result
+
+    def locate_frame(self, df: pd.DataFrame, lat_column: str = 'Latitude', lng_column: str = 'Longitude', columns: list = None) -> pd.DataFrame:
+        """
+        Adds the `columns` of the neighbourhood of every row of `df` (all non geometry columns by default),
+        they are missing for rows outside all neighbourhoods.
+        """
+        columns = columns or [column for column in self.boundaries.columns if column != self.boundaries.geometry.name]
+        index = self.locate(df[lat_column].to_numpy(), df[lng_column].to_numpy())
+
+        attributes = pd.DataFrame(self.boundaries[columns]).reindex(index)
+        attributes.index = df.index
+        return pd.concat([df, attributes], axis=1)
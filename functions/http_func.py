@@ -0,0 +1,264 @@
+# Imports
+import os
+import re
+import sys
+import json
+import time
+import random
+import sqlite3
+import hashlib
+import requests
+import threading
+
+from datetime import datetime
+from requests.adapters import HTTPAdapter
+
+# modifying the root path for imports
+current = os.path.dirname(os.path.realpath(__file__))
+parent = os.path.dirname(current)
+sys.path.append(parent)
+
+from functions.table_func import parse_json
+from config import path_to_http_cache, HTTP_CACHE_MAX_MB, HTTP_CACHE_TTL, API_RATE_LIMIT, API_BURST, API_IMMUTABLE_AFTER_MONTHS
+
+
+# status codes after which a request is tried again
+RETRY_STATUS = (429, 500, 502, 503, 504)
+
+
+class TokenBucket:
+    """
+    Thread safe token bucket: `rate` tokens are added per second up to `capacity`, every request takes one token
+    and waits when the bucket is empty. This keeps the average below `rate` requests per second while allowing short bursts.
+    """
+    def __init__(self, rate: float, capacity: int):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+    def pause(self, seconds: float):
+        """Empties the bucket for `seconds`, used when the server asks us to slow down (429 with Retry-After)."""
+        with self.lock:
+            self.tokens = min(self.tokens, 0) - seconds * self.rate
+
+
+class ResponseCache:
+    """
+    On-disk cache of response bodies in a SQLite database, keyed by the hash of the request.
+
+    Every entry has an optional expiry time (None: never expires). When the cache grows larger than `max_bytes`,
+    the least recently used entries are evicted.
+    """
+    def __init__(self, cache_dir: str = path_to_http_cache, max_bytes: int = HTTP_CACHE_MAX_MB * 1024 * 1024):
+        os.makedirs(cache_dir, exist_ok=True)
+        self.path = os.path.join(cache_dir, 'responses.sqlite')
+        self.max_bytes = max_bytes
+        self.local = threading.local()
+
+        with self.connection() as conn:
+            conn.execute('CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, url TEXT, body BLOB, size INTEGER, expires REAL, accessed REAL)')
+            conn.execute('CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed)')
+            # running total of the sizes of the bodies, kept up to date by triggers such that an insert does not sum the whole table
+            conn.execute('CREATE TABLE IF NOT EXISTS cache_size (id INTEGER PRIMARY KEY CHECK (id = 0), total INTEGER)')
+            conn.execute('INSERT OR IGNORE INTO cache_size SELECT 0, COALESCE(SUM(size), 0) FROM responses')
+            conn.execute('CREATE TRIGGER IF NOT EXISTS responses_insert AFTER INSERT ON responses BEGIN UPDATE cache_size SET total = total + NEW.size; END')
+            conn.execute('CREATE TRIGGER IF NOT EXISTS responses_delete AFTER DELETE ON responses BEGIN UPDATE cache_size SET total = total - OLD.size; END')
+
+    def connection(self) -> sqlite3.Connection:
+        # sqlite connections can not be shared between threads, so every thread opens its own
+        conn = getattr(self.local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute('PRAGMA journal_mode=WAL')
+            self.local.conn = conn
+        return conn
+
+    def get(self, key: str):
+        """The cached body of `key`, None when it is not cached or expired."""
+        conn = self.connection()
+        row = conn.execute('SELECT body, expires FROM responses WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            return None
+
+        body, expires = row
+        now = time.time()
+        with conn:
+            if expires is not None and expires < now:
+                conn.execute('DELETE FROM responses WHERE key = ?', (key,))
+                return None
+            conn.execute('UPDATE responses SET accessed = ? WHERE key = ?', (now, key))
+        return body
+
+    def put(self, key: str, url: str, body: bytes, ttl: float = None):
+        """Stores `body` under `key`, it expires after `ttl` seconds (never when None)."""
+        now = time.time()
+        expires = None if ttl is None else now + ttl
+        conn = self.connection()
+        with conn:
+            # deleted first instead of INSERT OR REPLACE, the replaced row would not fire the delete trigger
+            conn.execute('DELETE FROM responses WHERE key = ?', (key,))
+            conn.execute('INSERT INTO responses VALUES (?, ?, ?, ?, ?, ?)', (key, url, body, len(body), expires, now))
+            total = conn.execute('SELECT total FROM cache_size').fetchone()[0]
+            if total > self.max_bytes:
+                self.evict(conn, total - int(self.max_bytes * 0.9))
+
+    @staticmethod
+    def evict(conn: sqlite3.Connection, n_bytes: int):
+        """Deletes the expired entries and then the least recently used entries until `n_bytes` are freed."""
+        conn.execute('DELETE FROM responses WHERE expires IS NOT NULL AND expires < ?', (time.time(),))
+        freed = 0
+        keys = []
+        for key, size in conn.execute('SELECT key, size FROM responses ORDER BY accessed'):
+            if freed >= n_bytes:
+                break
+            keys.append((key,))
+            freed += size
+        conn.executemany('DELETE FROM responses WHERE key = ?', keys)
+
+    def clear(self):
+        with self.connection() as conn:
+            conn.execute('DELETE FROM responses')
+
+
+_session = None
+_cache = None
+_bucket = TokenBucket(API_RATE_LIMIT, API_BURST)
+_init_lock = threading.Lock()
+
+
+def get_session() -> requests.Session:
+    """The session shared by all extractors, it keeps the connections to the API alive between requests."""
+    global _session
+    with _init_lock:
+        if _session is None:
+            _session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=4, pool_maxsize=API_BURST)
+            _session.mount('https://', adapter)
+            _session.mount('http://', adapter)
+    return _session
+
+
+def get_cache() -> ResponseCache:
+    global _cache
+    with _init_lock:
+        if _cache is None:
+            _cache = ResponseCache()
+    return _cache
+
+
+def ttl_for(url: str, data: dict = None):
+    """
+    How long the response of a request may be cached: responses of months older than API_IMMUTABLE_AFTER_MONTHS
+    never expire, everything else (recent months, the latest month, metadata) expires after HTTP_CACHE_TTL seconds.
+    """
+    match = re.search(r'date=(\d{4})-(\d{1,2})', url) or re.match(r'(\d{4})-(\d{1,2})', (data or {}).get('date', ''))
+    if match is None:
+        return HTTP_CACHE_TTL
+
+    now = datetime.now()
+    age = (now.year * 12 + now.month) - (int(match.group(1)) * 12 + int(match.group(2)))
+    return None if age > API_IMMUTABLE_AFTER_MONTHS else HTTP_CACHE_TTL
+
+
+def _retry_after(response: requests.Response, attempt: int) -> float:
+    # the server tells us how long to wait, otherwise exponential backoff with jitter
+    retry_after = response.headers.get('Retry-After') if response is not None else None
+    if retry_after is not None and retry_after.isdigit():
+        return float(retry_after)
+    return min(60, 2 ** attempt) * (0.5 + random.random() / 2)
+
+
+def request(method: str, url: str, data: dict = None, ttl='auto', retry_on: tuple = RETRY_STATUS, max_retries: int = 5, timeout: tuple = (10, 60)) -> bytes:
+    """
+    Sends a rate limited request through the shared session and returns the body of the response.
+
+    Successful responses are cached on disk, the requests on 429 and the statuses in `retry_on`
+    (and on dropped connections) are tried again with exponential backoff, honouring the Retry-After header.
+
+    Parameters
+    -
+    method - "GET" or "POST"\n
+    url - the url of the request\n
+    data - form data of a POST request (optional)\n
+    ttl - seconds the response is cached, None to cache it forever, 0 to not cache it,
+        "auto" to decide from the month of the request (see ttl_for) (optional)\n
+    retry_on - the status codes after which the request is tried again (optional)\n
+    max_retries - how many times a request is tried again before giving up (optional)
+
+    Returns
+    -
+    The body of the response as bytes.
+
+    Raises
+    -
+    requests.HTTPError - If the server answers with an error status that is not retried, or still fails after `max_retries`.
+    """
+    if ttl == 'auto':
+        ttl = ttl_for(url, data)
+
+    key = hashlib.sha256(f"{method} {url} {json.dumps(data, sort_keys=True) if data else ''}".encode()).hexdigest()
+    if ttl != 0:
+        body = get_cache().get(key)
+        if body is not None:
+            return body
+
+    session = get_session()
+    for attempt in range(max_retries + 1):
+        _bucket.acquire()
+        try:
+            response = session.request(method, url, data=data, timeout=timeout)
+        except (requests.ConnectionError, requests.Timeout) as e:
+            if attempt == max_retries:
+                raise
+            time.sleep(_retry_after(None, attempt))
+            continue
+
+        if response.status_code in retry_on and attempt < max_retries:
+            delay = _retry_after(response, attempt)
+            if response.status_code == 429:
+                _bucket.pause(delay)
+            time.sleep(delay)
+            continue
+
+        response.raise_for_status()
+        break
+
+    if ttl != 0:
+        get_cache().put(key, url, response.content, ttl)
+    return response.content
+
+
+def get_json(url: str, parse=parse_json, **kwargs):
+    """
+    GET request to the API (see `request`) which returns the decoded json (parsed by orjson when it is installed),
+    or the body decoded by `parse`, e.g. into a table (see response_parser in functions/table_func.py).
+
+    Examples
+    -
+    ```python
+    crimes = get_json('https://data.police.uk/api/crimes-street/all-crime?lat=52.629729&lng=-1.131592&date=2023-01')
+    ```
+    """
+    return parse(request('GET', url, **kwargs))
+
+
+def post_json(url: str, data: dict, parse=parse_json, **kwargs):
+    """
+    POST request with form `data` to the API (see `request`) which returns the decoded json,
+    used for parameters that are too long for the url (e.g. large custom areas).
+    """
+    return parse(request('POST', url, data=data, **kwargs))
@@ -0,0 +1,391 @@
+# Imports
+import os
+import json
+import time
+import sqlite3
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pv
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+from typing import List
+
+from functions.borough_func import BOROUGH_DTYPE, BOROUGH_SOURCES, canonical_borough
+
+
+MANIFEST_NAME = 'manifest.json'
+
+# partitioned parquet dataset which replaces met_crime_data.pkl
+MET_CRIME_STORE = 'data/met_data/met_crime_store'
+
+# partitioned parquet dataset with the answer counts of the PAS ward level surveys, one partition per financial year
+PAS_WARD_LEVEL_STORE = 'data/pas_data_ward_level/pas_ward_level_store'
+
+# outcomes of individual crimes resolved through the API (see resolve_crime_outcomes in functions/api_func.py)
+OUTCOME_STORE = 'data/met_data/crime_outcomes.sqlite'
+
+# reference data of the forces and neighbourhoods (see get_metadata_json in functions/api_func.py)
+METADATA_STORE = 'data/met_data/metadata.sqlite'
+
+# long table (Date, Borough, Concern, Count) of the crime types that people see as the main concern, replaces PAS_crime.csv
+PAS_CRIME_TABLE = 'data/pas_data_ward_level/PAS_crime.parquet'
+
+# rows per row group of the crime store, a borough spans a few row groups of a month
+MET_CRIME_ROW_GROUP_SIZE = 8192
+
+# street crimes counted per hexagon of several resolutions, month and crime type (see data_preprocessors/MET_hex_preprocessor.py)
+MET_CRIME_HEX_TABLE = 'data/met_data/met_crime_hex.parquet'
+
+# schema of the police street-level crime csv files, low cardinality columns are dictionary encoded
+# and the coordinates do not need double precision
+MET_CRIME_SCHEMA = pa.schema([
+    ('Crime ID', pa.string()),
+    ('Month', pa.string()),
+    ('Reported by', pa.dictionary(pa.int32(), pa.string())),
+    ('Falls within', pa.dictionary(pa.int32(), pa.string())),
+    ('Longitude', pa.float32()),
+    ('Latitude', pa.float32()),
+    ('Location', pa.string()),
+    ('LSOA code', pa.dictionary(pa.int32(), pa.string())),
+    ('LSOA name', pa.dictionary(pa.int32(), pa.string())),
+    ('Crime type', pa.dictionary(pa.int32(), pa.string())),
+    ('Last outcome category', pa.dictionary(pa.int32(), pa.string())),
+    ('Context', pa.string()),
+])
+
+# schema of the crime store: the month is the partition, the borough is read as a plain string
+# (pyarrow only prunes row groups on plain columns) and encoded after the filter
+MET_CRIME_STORE_SCHEMA = pa.schema([field for field in MET_CRIME_SCHEMA if field.name != 'Month']
+                                   + [('Borough', pa.string()), ('Month', pa.string())])
+
+
+def read_manifest(data_dir: str) -> dict:
+    """
+    Reads the manifest of the extracted police data in `data_dir`.
+
+    The manifest records, for every month that is materialised on disk, the archive it was taken from
+    and the CRC and size of every extracted file:
+
+    ```python
+    {"months": {"2019-12": {"archive": "2022-12", "files": {"2019-12/2019-12-metropolitan-street.csv": {"crc": 1234, "size": 5678}}}}}
+    ```
+
+    Returns
+    -
+    The manifest as a dictionary, an empty manifest if there is none yet.
+    """
+    path = os.path.join(data_dir, MANIFEST_NAME)
+    if not os.path.exists(path):
+        return {'months': {}}
+
+    with open(path) as f:
+        return json.load(f)
+
+
+def write_manifest(data_dir: str, manifest: dict):
+    """
+    Writes the manifest to `data_dir` atomically, such that an interrupted run never leaves a half written manifest.
+    """
+    path = os.path.join(data_dir, MANIFEST_NAME)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    os.replace(tmp_path, path)
+
+
+def manifest_files(data_dir: str, suffix: str = '-metropolitan-street.csv') -> list:
+    """
+    Lists the extracted files ending with `suffix`, exactly one per file name and month.
+
+    Uses the manifest when there is one, otherwise walks `data_dir` and keeps only the first copy of every file name,
+    such that months extracted more than once are never read twice.
+    """
+    manifest = read_manifest(data_dir)
+    if manifest['months']:
+        return [os.path.join(data_dir, file)
+                for month in sorted(manifest['months'])
+                for file in sorted(manifest['months'][month]['files'])
+                if file.endswith(suffix) and os.path.exists(os.path.join(data_dir, file))]
+
+    seen = {}
+    for root, dirs, files in sorted(os.walk(data_dir)):
+        for file in sorted(files):
+            if file.endswith(suffix) and file not in seen:
+                seen[file] = os.path.join(root, file)
+    return list(seen.values())
+
+
+def month_index(month: str) -> int:
+    """
+    Converts a "YYYY-MM" month into a number of months, such that months can be compared and subtracted.
+    """
+    year, month = month.split('-')
+    return int(year) * 12 + int(month) - 1
+
+
+def hidden_tmp_path(path: str) -> str:
+    """
+    Path of the temporary file of an atomic write of `path` inside a dataset, pyarrow skips files starting with a dot,
+    such that an interrupted write never becomes part of the dataset.
+    """
+    return os.path.join(os.path.dirname(path), '.' + os.path.basename(path) + '.tmp')
+
+
+def borough_key(lsoa_names: pa.Array) -> pa.Array:
+    """
+    The borough of every LSOA, its name without the trailing LSOA number (e.g. "City of London 001A" -> "City of London")
+    as in the gazetteer (see functions/borough_func.py), null when the LSOA is unknown or outside London.
+
+    Only the distinct LSOA names (the dictionary) are parsed, the rows are mapped through their dictionary indices.
+    """
+    lsoa_names = pc.dictionary_encode(lsoa_names) if not pa.types.is_dictionary(lsoa_names.type) else lsoa_names
+    names = pc.replace_substring_regex(lsoa_names.dictionary, pattern=r' [^ ]+$', replacement='')
+    names = pa.array([canonical_borough(name) for name in names.to_pylist()], pa.string())
+    return pc.take(names, lsoa_names.indices)
+
+
+def write_met_crime_month(csv_path: str, store_dir: str = MET_CRIME_STORE) -> int:
+    """
+    Converts one monthly `-metropolitan-street.csv` file into its partition of the street-level crime store
+    (`<store_dir>/Month=YYYY-MM/part-0.parquet`).
+
+    The csv is parsed by pyarrow with the explicit MET_CRIME_SCHEMA (no type inference, no pandas),
+    so only one month is held in memory. The partition is skipped when it is newer than the csv and the borough gazetteer.
+
+    A Borough column is derived from the LSOA name (see borough_key) and the rows are sorted by it,
+    written in small row groups, such that a borough is read through the row group statistics without scanning the month.
+
+    Returns
+    -
+    The number of rows in the partition.
+    """
+    month = os.path.basename(csv_path)[:7]
+    partition_dir = os.path.join(store_dir, f'Month={month}')
+    partition_path = os.path.join(partition_dir, 'part-0.parquet')
+
+    # the partition is rewritten when the csv or the borough names (BOROUGH_SOURCES) changed
+    written_after = max(os.path.getmtime(path) for path in [csv_path] + BOROUGH_SOURCES)
+    if os.path.exists(partition_path) and os.path.getmtime(partition_path) >= written_after \
+            and 'Borough' in pq.read_schema(partition_path).names:
+        return pq.ParquetFile(partition_path).metadata.num_rows
+
+    convert_options = pv.ConvertOptions(column_types=MET_CRIME_SCHEMA, include_columns=MET_CRIME_SCHEMA.names, include_missing_columns=True)
+    table = pv.read_csv(csv_path, convert_options=convert_options)
+
+    # the month is stored in the partition path
+    table = table.drop(['Month'])
+
+    # the borough is written as plain strings (parquet encodes them as a dictionary anyway), the row group statistics
+    # of arrow dictionary columns are not used to skip row groups
+    borough = borough_key(table['LSOA name'].combine_chunks())
+    table = table.append_column('Borough', borough)
+    table = table.take(pc.sort_indices(borough))
+
+    os.makedirs(partition_dir, exist_ok=True)
+    tmp_path = hidden_tmp_path(partition_path)
+    pq.write_table(table, tmp_path, row_group_size=MET_CRIME_ROW_GROUP_SIZE)
+    os.replace(tmp_path, partition_path)
+
+    return table.num_rows
+
+
+def open_met_crime_store(store_dir: str = MET_CRIME_STORE) -> ds.Dataset:
+    """
+    Opens the street-level crime store without reading any data, only the file listing and the schema are loaded.
+    """
+    partitioning = ds.partitioning(pa.schema([('Month', pa.string())]), flavor='hive')
+    return ds.dataset(store_dir, format='parquet', partitioning=partitioning, schema=MET_CRIME_STORE_SCHEMA)
+
+
+def _borough_categories(df: pd.DataFrame) -> pd.DataFrame:
+    # the categories of the partitions are unified in the order they are read, the gazetteer fixes their order
+    if 'Borough' in df.columns:
+        df['Borough'] = df['Borough'].astype(BOROUGH_DTYPE)
+    return df
+
+
+def read_met_crime(dataset: ds.Dataset, columns: List[str] = None, months: List[str] = None, boroughs: List[str] = None) -> pd.DataFrame:
+    """
+    Reads the street-level crime data from the store.
+
+    Only the requested `columns` are read, only the partitions of the requested `months` are opened
+    and only the row groups of the requested `boroughs` are read, leave them as None to read everything.
+
+    Examples
+    -
+    ```python
+    df = read_met_crime(open_met_crime_store(), columns=['Borough', 'Crime type'], months=['2023-12'], boroughs=['Camden'])
+    ```
+    """
+    filter_ = None
+    if months is not None:
+        filter_ = ds.field('Month').isin(list(months))
+    if boroughs is not None:
+        borough_filter = ds.field('Borough').isin(list(boroughs))
+        filter_ = borough_filter if filter_ is None else filter_ & borough_filter
+
+    table = dataset.to_table(columns=columns, filter=filter_)
+    if 'Borough' in table.column_names:
+        # the strings of the read rows are encoded once, pandas then builds the categorical from the dictionary
+        table = table.set_column(table.column_names.index('Borough'), 'Borough', pc.dictionary_encode(table['Borough']))
+    return _borough_categories(table.to_pandas())
+
+
+def write_partition(df: pd.DataFrame, store_dir: str, field: str, value: str):
+    """
+    Writes `df` as the partition `<store_dir>/<field>=<value>/part-0.parquet`, replacing the previous one atomically.
+    """
+    partition_dir = os.path.join(store_dir, f'{field}={value}')
+    partition_path = os.path.join(partition_dir, 'part-0.parquet')
+
+    os.makedirs(partition_dir, exist_ok=True)
+    tmp_path = hidden_tmp_path(partition_path)
+    pq.write_table(pa.Table.from_pandas(df, preserve_index=False), tmp_path)
+    os.replace(tmp_path, partition_path)
+
+
+def open_pas_ward_level_store(store_dir: str = PAS_WARD_LEVEL_STORE) -> ds.Dataset:
+    """
+    Opens the store with the answer counts of the PAS ward level surveys (partitioned by financial year, FY).
+    """
+    partitioning = ds.partitioning(pa.schema([('FY', pa.string())]), flavor='hive')
+    return ds.dataset(store_dir, format='parquet', partitioning=partitioning)
+
+
+def read_pas_answers(dataset: ds.Dataset, years: List[str] = None, measures: List[str] = None) -> pd.DataFrame:
+    """
+    Reads the answer counts (FY, Borough, Date, Ethnicity, Measure, Answer, Count) of the PAS ward level surveys,
+    only for the requested financial `years` and `measures` (question codes), leave them as None to read everything.
+
+    Examples
+    -
+    ```python
+    df = read_pas_answers(open_pas_ward_level_store(), years=['20-21'], measures=['Q13'])
+    ```
+    """
+    filter_ = None
+    if years is not None:
+        filter_ = ds.field('FY').isin(list(years))
+    if measures is not None:
+        measure_filter = ds.field('Measure').isin(list(measures))
+        filter_ = measure_filter if filter_ is None else filter_ & measure_filter
+
+    return _borough_categories(dataset.to_table(filter=filter_).to_pandas())
+
+
+def write_table(df: pd.DataFrame, path: str):
+    """
+    Writes `df` as a single parquet file, replacing the previous one atomically.
+    """
+    tmp_path = path + '.tmp'
+    pq.write_table(pa.Table.from_pandas(df, preserve_index=False), tmp_path)
+    os.replace(tmp_path, path)
+
+
+def read_pas_crime(path: str = PAS_CRIME_TABLE, boroughs: List[str] = None, dates: List[str] = None) -> pd.DataFrame:
+    """
+    Reads the crime concerns (Date, Borough, Concern, Count) of the PAS, only the rows of the requested `boroughs`
+    and `dates` ("YYYY-MM") are returned, leave them as None to read everything.
+
+    Examples
+    -
+    ```python
+    df = read_pas_crime(boroughs=['Camden'], dates=['2020-12'])
+    ```
+    """
+    filters = []
+    if boroughs is not None:
+        filters.append(('Borough', 'in', list(boroughs)))
+    if dates is not None:
+        filters.append(('Date', 'in', list(dates)))
+
+    return _borough_categories(pq.read_table(path, filters=filters or None).to_pandas())
+
+
+def read_met_crime_hex(path: str = MET_CRIME_HEX_TABLE, resolution: int = None, months: List[str] = None, crime_types: List[str] = None) -> pd.DataFrame:
+    """
+    Reads the street crime counts (Resolution, Cell, Month, Crime type, Count) per hexagon,
+    only the rows of the requested `resolution`, `months` and `crime_types` are returned, leave them as None to read everything.
+
+    Examples
+    -
+    ```python
+    df = read_met_crime_hex(resolution=3, months=['2023-12'])
+    ```
+    """
+    filters = []
+    if resolution is not None:
+        filters.append(('Resolution', '=', resolution))
+    if months is not None:
+        filters.append(('Month', 'in', list(months)))
+    if crime_types is not None:
+        filters.append(('Crime type', 'in', list(crime_types)))
+
+    return pq.read_table(path, filters=filters or None).to_pandas()
+
+
+def open_outcome_store(path: str = OUTCOME_STORE) -> sqlite3.Connection:
+    """
+    Opens (and creates) the SQLite store with the outcomes of individual crimes: one row per crime id with the outcomes
+    as returned by the API (json), whether the case is final and when the outcomes were resolved (unix time).
+    """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    conn = sqlite3.connect(path, timeout=30)
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('CREATE TABLE IF NOT EXISTS outcomes (crime_id TEXT PRIMARY KEY, last_outcome TEXT, outcomes TEXT, final INTEGER, resolved_at REAL)')
+    return conn
+
+
+def read_outcomes(conn: sqlite3.Connection, crime_ids: List[str] = None) -> pd.DataFrame:
+    """
+    Reads the stored outcomes (crime_id, last_outcome, outcomes, final, resolved_at) of `crime_ids`, of all crimes when None.
+    """
+    if crime_ids is None:
+        return pd.read_sql_query('SELECT * FROM outcomes', conn)
+
+    # the ids are joined through a temporary table, an IN (...) list is limited in length
+    conn.execute('CREATE TEMP TABLE IF NOT EXISTS requested (crime_id TEXT PRIMARY KEY)')
+    conn.execute('DELETE FROM requested')
+    conn.executemany('INSERT OR IGNORE INTO requested VALUES (?)', ((crime_id,) for crime_id in crime_ids))
+    return pd.read_sql_query('SELECT outcomes.* FROM outcomes JOIN requested USING (crime_id)', conn)
+
+
+def write_outcomes(conn: sqlite3.Connection, rows: List[tuple]):
+    """
+    Stores (crime_id, last_outcome, outcomes, final) rows, the resolved_at timestamp is set to now.
+    """
+    now = time.time()
+    with conn:
+        conn.executemany('INSERT OR REPLACE INTO outcomes VALUES (?, ?, ?, ?, ?)',
+                         [(crime_id, last_outcome, outcomes, int(final), now) for crime_id, last_outcome, outcomes, final in rows])
+
+
+def open_metadata_store(path: str = METADATA_STORE) -> sqlite3.Connection:
+    """
+    Opens (and creates) the SQLite catalogue with the reference data of the API (forces, neighbourhoods, teams, events, priorities):
+    one row per url with the response (json) and the `crime-last-updated` date of the API when it was fetched.
+    """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    conn = sqlite3.connect(path, timeout=30)
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('CREATE TABLE IF NOT EXISTS metadata (url TEXT PRIMARY KEY, body TEXT, last_updated TEXT, fetched_at REAL)')
+    return conn
+
+
+def read_metadata(conn: sqlite3.Connection, url: str, last_updated: str = None):
+    """
+    The stored response of `url` as json, None when it is not stored or was fetched before the API was last updated.
+    Leave `last_updated` as None to accept any stored response (e.g. when the API can not be reached).
+    """
+    row = conn.execute('SELECT body, last_updated FROM metadata WHERE url = ?', (url,)).fetchone()
+    if row is None or (last_updated is not None and row[1] != last_updated):
+        return None
+    return json.loads(row[0])
+
+
+def write_metadata(conn: sqlite3.Connection, url: str, body, last_updated: str):
+    with conn:
+        conn.execute('INSERT OR REPLACE INTO metadata VALUES (?, ?, ?, ?)', (url, json.dumps(body), last_updated, time.time()))
@@ -0,0 +1,170 @@
+# Imports
+import io
+import json
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.json as pj
+import pyarrow.compute as pc
+
+from typing import List
+
+# orjson parses the responses of the API several times faster than json, it is optional
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def parse_json(body: bytes):
+    """Decodes the body of a response, with orjson when it is installed."""
+    if orjson is not None:
+        return orjson.loads(body)
+    return json.loads(body)
+
+
+# nested schemas of the responses of the API, fields that are not in a schema are ignored and missing fields are null
+_street = pa.struct([('id', pa.int64()), ('name', pa.string())])
+_location = pa.struct([('latitude', pa.string()), ('longitude', pa.string()), ('street', _street)])
+
+CRIME_SCHEMA = pa.schema([
+    ('id', pa.int64()),
+    ('persistent_id', pa.string()),
+    ('category', pa.string()),
+    ('month', pa.string()),
+    ('location_type', pa.string()),
+    ('location_subtype', pa.string()),
+    ('location', _location),
+    ('context', pa.string()),
+    ('outcome_status', pa.struct([('category', pa.string()), ('date', pa.string())])),
+])
+
+OUTCOME_SCHEMA = pa.schema([
+    ('category', pa.struct([('code', pa.string()), ('name', pa.string())])),
+    ('date', pa.string()),
+    ('person_id', pa.int64()),
+    ('crime', pa.struct([(field.name, field.type) for field in CRIME_SCHEMA if field.name != 'outcome_status'])),
+])
+
+STOP_SEARCH_SCHEMA = pa.schema([
+    ('type', pa.string()),
+    ('involved_person', pa.bool_()),
+    ('datetime', pa.string()),
+    ('operation', pa.bool_()),
+    ('operation_name', pa.string()),
+    ('location', _location),
+    ('gender', pa.string()),
+    ('age_range', pa.string()),
+    ('self_defined_ethnicity', pa.string()),
+    ('officer_defined_ethnicity', pa.string()),
+    ('legislation', pa.string()),
+    ('object_of_search', pa.string()),
+    ('outcome_object', pa.struct([('id', pa.string()), ('name', pa.string())])),
+    ('outcome_linked_to_object_of_search', pa.bool_()),
+    ('removal_of_more_than_outer_clothing', pa.bool_()),
+])
+
+SCHEMAS = {
+    'crime': CRIME_SCHEMA,
+    'outcome': OUTCOME_SCHEMA,
+    'stop_search': STOP_SEARCH_SCHEMA,
+}
+
+# the coordinates are strings in the responses
+_coordinates = ('location.latitude', 'location.longitude', 'crime.location.latitude', 'crime.location.longitude')
+
+
+def flatten(table: pa.Table) -> pa.Table:
+    """Flattens the nested columns, e.g. `location.street.name`, and converts the coordinates to floats."""
+    while any(pa.types.is_struct(field.type) for field in table.schema):
+        table = table.flatten()
+
+    for name in _coordinates:
+        if name in table.column_names:
+            table = table.set_column(table.column_names.index(name), name, table[name].cast(pa.float64()))
+    return table
+
+
+def to_table(records: list, endpoint: str) -> pa.Table:
+    """
+    Converts the decoded response of an endpoint into a flat pyarrow Table with the fixed schema of the endpoint
+    (see SCHEMAS), such that the tables of many requests can be concatenated without conversions.
+    """
+    return flatten(pa.Table.from_pylist(records, schema=SCHEMAS[endpoint]))
+
+
+def read_table(body: bytes, endpoint: str) -> pa.Table:
+    """
+    Parses the body of a response (a JSON array of records) straight into the flat pyarrow Table of `to_table`,
+    without decoding a Python dictionary per record.
+    """
+    # pyarrow reads newline delimited records, the array is wrapped into the single record {"rows": [...]} instead of being split
+    wrapped = b'{"rows": ' + body + b'}'
+    read_options = pj.ReadOptions(block_size=len(wrapped) + 1, use_threads=False)
+    parse_options = pj.ParseOptions(explicit_schema=pa.schema([('rows', pa.list_(pa.struct(list(SCHEMAS[endpoint]))))]),
+                                    unexpected_field_behavior='ignore', newlines_in_values=True)
+    rows = pj.read_json(io.BytesIO(wrapped), read_options=read_options, parse_options=parse_options)['rows']
+    return flatten(pa.Table.from_struct_array(pa.concat_arrays([chunk.flatten() for chunk in rows.chunks])))
+
+
+def empty_table(endpoint: str) -> pa.Table:
+    """The flat table of an endpoint without rows."""
+    return to_table([], endpoint)
+
+
+def to_output(records: list, endpoint: str, output: str = 'json'):
+    """
+    Returns the decoded response of an endpoint in the requested `output` format:
+    "json" (the list of dictionaries as returned by the API), "table" (a flat pyarrow Table) or "pandas" (a flat DataFrame).
+
+    Raises
+    -
+    ValueError - If the output format is unknown.
+    """
+    if output == 'json':
+        return records
+    if output == 'table':
+        return to_table(records, endpoint)
+    if output == 'pandas':
+        return to_table(records, endpoint).to_pandas()
+    raise ValueError(f'Specify the output as "json", "table" or "pandas", you passed {output}')
+
+
+def response_parser(endpoint: str, output: str = 'json'):
+    """
+    The function which decodes the body of a response of an endpoint into the `output` format of `to_output`,
+    tables are parsed from the bytes with `read_table`.
+
+    Raises
+    -
+    ValueError - If the output format is unknown.
+
+    Examples
+    -
+    ```python
+    crimes = get_json(url, parse=response_parser('crime', 'table'))
+    ```
+    """
+    if output == 'json':
+        return parse_json
+    if output == 'table':
+        return lambda body: read_table(body, endpoint)
+    if output == 'pandas':
+        return lambda body: read_table(body, endpoint).to_pandas()
+    raise ValueError(f'Specify the output as "json", "table" or "pandas", you passed {output}')
+
+
+def drop_duplicate_crimes(table: pa.Table) -> pa.Table:
+    """Keeps the first row of every crime of a flat crime table, crimes are identified by `persistent_id`, or `id` when it is empty."""
+    persistent_id = pc.fill_null(table['persistent_id'], '')
+    key = pc.if_else(pc.equal(persistent_id, ''), pc.cast(table['id'], pa.string()), persistent_id)
+    rows = pa.table({'key': key, 'row': np.arange(table.num_rows)}).group_by('key').aggregate([('row', 'min')])
+    return table.take(np.sort(rows['row_min'].to_numpy()))
+
+
+def concat_tables(tables: List[pa.Table]) -> pa.Table:
+    """
+    Concatenates the tables of many requests (e.g. a multi-month pull) of the same endpoint,
+    the columns are only referenced, not copied.
+    """
+    return pa.concat_tables(tables)